@@ -1,60 +1,88 @@
 # api_setup.py - Version améliorée
+import asyncio
+import logging
 import os
 import aiohttp
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 HEADERS = {
     "cal-api-version": "2024-06-14",
     "Authorization": "Bearer " + os.getenv("CAL_API_KEY"),
 }
 
 SESSION_LENGTH = 60
+SCHEDULE_NAME = "Piscinik - Services Piscine"
+
+# Session HTTP partagée pour tous les appels Cal.com (pool de connexions + keep-alive)
+_session: aiohttp.ClientSession | None = None
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Returns the shared Cal.com session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=15),
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """Closes the shared Cal.com session and its pooled connections"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
 
 
 async def get_event_id(slug: str) -> str | None:
     """Searches for an event type. Returns the event ID if found, None if not"""
     payload = {"username": os.getenv("CAL_API_USERNAME"), "eventSlug": slug}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://api.cal.com/v2/event-types", params=payload, headers=HEADERS
-        ) as response:
-            data = await response.json()
-            print(f"DEBUG get_event_id for {slug}: {data}")  # Debug
-            
-            if data.get("status") == "success" and data.get("data"):
-                return data["data"][0]["id"]
-            elif data.get("status") == "error":
-                print(f"ERROR retrieving event type {slug}: {data}")
-                return None
-            else:
-                return None
+    session = await _get_session()
+    async with session.get(
+        "https://api.cal.com/v2/event-types", params=payload
+    ) as response:
+        data = await response.json(loads=orjson.loads)
+        logger.debug("get_event_id for %s: %s", slug, data)
+        
+        if data.get("status") == "success" and data.get("data"):
+            return data["data"][0]["id"]
+        elif data.get("status") == "error":
+            logger.error("Error retrieving event type %s: %s", slug, data)
+            return None
+        else:
+            return None
 
 
 async def search_schedule(name: str) -> str | None:
     """Checks if needed schedule already exists, returns schedule ID"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://api.cal.com/v2/schedules/default", headers=HEADERS
-        ) as response:
-            data = await response.json()
-            print(f"DEBUG search_schedule: {data}")  # Debug
-            
-            if (
-                data.get("status") == "success"
-                and data.get("data")
-                and data["data"].get("name") == name
-            ):
-                return data["data"]["id"]
-            else:
-                return None
+    session = await _get_session()
+    async with session.get("https://api.cal.com/v2/schedules/default") as response:
+        data = await response.json(loads=orjson.loads)
+        logger.debug("search_schedule: %s", data)
+        
+        if (
+            data.get("status") == "success"
+            and data.get("data")
+            and data["data"].get("name") == name
+        ):
+            return data["data"]["id"]
+        else:
+            return None
 
 
 async def create_schedule() -> str:
     """Sets schedule for Piscinik, returns schedule ID"""
     payload = {
-        "name": "Piscinik - Services Piscine",
+        "name": SCHEDULE_NAME,
         "timeZone": "Europe/Paris",
         "isDefault": True,
         "availability": [
@@ -84,17 +112,17 @@ async def create_schedule() -> str:
             },
         ],
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://api.cal.com/v2/schedules", json=payload, headers=HEADERS
-        ) as response:
-            data = await response.json()
-            print(f"DEBUG create_schedule: {data}")  # Debug
-            
-            if data.get("status") == "success" and data.get("data"):
-                return data["data"]["id"]
-            else:
-                raise Exception(f"Error creating schedule: {data}")
+    session = await _get_session()
+    async with session.post(
+        "https://api.cal.com/v2/schedules", json=payload
+    ) as response:
+        data = await response.json(loads=orjson.loads)
+        logger.debug("create_schedule: %s", data)
+        
+        if data.get("status") == "success" and data.get("data"):
+            return data["data"]["id"]
+        else:
+            raise Exception(f"Error creating schedule: {data}")
 
 
 async def create_event_type(*, title: str, slug: str, schedule_id: str) -> str:
@@ -112,34 +140,24 @@ async def create_event_type(*, title: str, slug: str, schedule_id: str) -> str:
             }
         ]
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://api.cal.com/v2/event-types", json=payload, headers=HEADERS
-        ) as response:
-            data = await response.json()
-            print(f"DEBUG create_event_type {slug}: {data}")  # Debug
-            
-            if data.get("status") == "success":
-                return data["data"]["id"]
-            else:
-                raise Exception(f"Error creating event type {slug}: {data}")
+    session = await _get_session()
+    async with session.post(
+        "https://api.cal.com/v2/event-types", json=payload
+    ) as response:
+        data = await response.json(loads=orjson.loads)
+        logger.debug("create_event_type %s: %s", slug, data)
+        
+        if data.get("status") == "success":
+            return data["data"]["id"]
+        else:
+            raise Exception(f"Error creating event type {slug}: {data}")
 
 
 async def setup_event_types() -> dict:
     """Ensures that the schedule and event types are set up correctly in Cal.com for Piscinik.
     Returns a dictionary with event slugs and their respective IDs"""
     
-    print("DEBUG: Starting setup_event_types...")
-    
-    # Vérifier et créer le planning
-    schedule_id = await search_schedule("Piscinik - Services Piscine")
-    if not schedule_id:
-        print("DEBUG: Creating new schedule...")
-        schedule_id = await create_schedule()
-    else:
-        print(f"DEBUG: Using existing schedule ID: {schedule_id}")
-
-    event_ids = {}
+    logger.debug("Starting setup_event_types...")
 
     # Services Piscinik à créer
     services = [
@@ -149,30 +167,53 @@ async def setup_event_types() -> dict:
         ("Installation d'Équipement", "installation-equipement"),
     ]
 
-    for title, slug in services:
-        try:
-            # Chercher l'événement existant
-            event_id = await get_event_id(slug)
-            if not event_id:
-                print(f"DEBUG: Creating event type: {slug}")
-                event_id = await create_event_type(
-                    title=title, 
-                    slug=slug, 
-                    schedule_id=schedule_id
-                )
-            else:
-                print(f"DEBUG: Using existing event ID for {slug}: {event_id}")
-                
-            event_ids[slug] = event_id
-            
-        except Exception as e:
-            print(f"ERROR setting up event type {slug}: {e}")
+    # Les recherches ne dépendent pas du planning : on lance tout en parallèle
+    schedule_task = asyncio.create_task(search_schedule(SCHEDULE_NAME))
+    lookups = await asyncio.gather(
+        *(get_event_id(slug) for _, slug in services),
+        return_exceptions=True,
+    )
+
+    event_ids = {}
+    missing = []
+    for (title, slug), result in zip(services, lookups):
+        if isinstance(result, Exception):
+            logger.error("Error setting up event type %s: %s", slug, result)
             # Continuer avec les autres événements
             continue
+        if result:
+            logger.debug("Using existing event ID for %s: %s", slug, result)
+            event_ids[slug] = result
+        else:
+            missing.append((title, slug))
 
-    print(f"DEBUG: Final event_ids: {event_ids}")
+    # Vérifier et créer le planning
+    schedule_id = await schedule_task
+    if not schedule_id:
+        logger.debug("Creating new schedule...")
+        schedule_id = await create_schedule()
+    else:
+        logger.debug("Using existing schedule ID: %s", schedule_id)
+
+    # Seules les créations ont besoin du planning
+    if missing:
+        created = await asyncio.gather(
+            *(
+                create_event_type(title=title, slug=slug, schedule_id=schedule_id)
+                for title, slug in missing
+            ),
+            return_exceptions=True,
+        )
+        for (_, slug), result in zip(missing, created):
+            if isinstance(result, Exception):
+                logger.error("Error setting up event type %s: %s", slug, result)
+                continue
+            logger.debug("Created event type %s: %s", slug, result)
+            event_ids[slug] = result
+
+    logger.debug("Final event_ids: %s", event_ids)
     
     if not event_ids:
         raise Exception("No event types could be created! Check your Cal.com API credentials and permissions.")
     
-    return event_ids
\ No newline at end of file
+    return event_ids
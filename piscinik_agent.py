@@ -1,18 +1,26 @@
 # piscinik_agent.py
+import asyncio
+import atexit
 import logging
 import os
-from dataclasses import dataclass
+import queue
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime
-from api_setup import setup_event_types
+from functools import cached_property
+from logging.handlers import QueueHandler, QueueListener
+from api_setup import close_session, setup_event_types
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from rag_system import close_rag_system, get_rag_system
 from tasks import Messenger, Receptionist, Scheduler, TechnicalExpert
+from tasks.messenger_task import close_supabase
 from transcript_collector import TranscriptCollector  # Enhanced version with real-time logging
 from livekit.agents import (
     Agent,
     AgentSession,
     AutoSubscribe,
     JobContext,
+    JobProcess,
     RoomInputOptions,
     RoomOutputOptions,
     WorkerOptions,
@@ -21,13 +29,28 @@ from livekit.agents import (
 from livekit.plugins import aws
 import openai
 
-# Clean logging setup
-logging.basicConfig(level=logging.INFO, format='%(message)s')
+# Log levels apply in every process importing this module, job processes included
+logging.getLogger().setLevel(logging.INFO)
 logging.getLogger("openai").setLevel(logging.ERROR)
 logging.getLogger("httpx").setLevel(logging.ERROR)
 logging.getLogger("httpcore").setLevel(logging.ERROR)
 
-class UserInfo(BaseModel):
+def setup_logging() -> QueueListener:
+    """Output of the CLI (worker) process: records are queued and written by a
+    listener thread, so logging never blocks its event loop on stdout. Job
+    processes don't run this and keep LiveKit's own log handling. The listener
+    is stopped at exit so the last records (shutdown logs) are flushed."""
+    log_queue = queue.SimpleQueue()
+    log_output = logging.StreamHandler()
+    log_output.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, log_output)
+    listener.start()
+    atexit.register(listener.stop)
+    logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+    return listener
+
+@dataclass(slots=True)
+class UserInfo:
     name: str | None = None
     email: str | None = None
     phone: str | None = None
@@ -35,29 +58,36 @@ class UserInfo(BaseModel):
     pool_type: str | None = None  # Type de piscine
     pool_size: str | None = None  # Taille de la piscine
 
-class SessionHistory(BaseModel):
+@dataclass(slots=True)
+class SessionHistory:
     """Historique des actions de la session pour éviter les redondances."""
-    actions: list[dict] = []
+    # Seules les 10 dernières actions sont conservées (éviction automatique)
+    actions: deque[dict] = field(default_factory=lambda: deque(maxlen=10))
     last_agent: str | None = None
     session_start: str | None = None
     last_action_time: str | None = None
 
 @dataclass
 class Agents:
-    @property
+    """Sub-agents of the session, built once and reused on every hand-off."""
+    _schedulers: dict[str, Agent] = field(default_factory=dict)
+
+    @cached_property
     def receptionist(self) -> Agent:
         return Receptionist()
     
-    @property
+    @cached_property
     def messenger(self) -> Agent:
         return Messenger()
     
-    @property
+    @cached_property
     def technical_expert(self) -> Agent:
         return TechnicalExpert()
     
     def scheduler(self, service: str) -> Agent:
-        return Scheduler(service=service)
+        if service not in self._schedulers:
+            self._schedulers[service] = Scheduler(service=service)
+        return self._schedulers[service]
 
 load_dotenv()
 
@@ -71,9 +101,33 @@ openai.api_key = OPENAI_API_KEY
 logger = logging.getLogger("piscinik-scheduler")
 logger.setLevel(logging.INFO)
 
+async def _warm_up(proc: JobProcess):
+    # Load the RAG index so the first technical question skips cold start
+    await get_rag_system()
+    try:
+        proc.userdata["event_ids"] = await setup_event_types()
+    finally:
+        # The shared Cal.com session is bound to this temporary event loop
+        await close_session()
+
+def prewarm(proc: JobProcess):
+    """Runs the Cal.com and RAG setup once per worker process, before any job."""
+    try:
+        asyncio.run(_warm_up(proc))
+    except Exception as e:
+        logger.error(f"Prewarm failed, setup will run in the job: {e}")
+
 async def entrypoint(ctx: JobContext):
-    # 1) Set up your Cal.com event types for Piscinik
-    event_ids = await setup_event_types()
+    # 1) Cal.com event types for Piscinik (prepared in prewarm when possible)
+    event_ids = ctx.proc.userdata.get("event_ids")
+    if event_ids is None:
+        event_ids = await setup_event_types()
+    # Keep the pooled Cal.com connections alive for the whole job
+    ctx.add_shutdown_callback(close_session)
+    # Persist the RAG query-embedding cache for warm restarts
+    ctx.add_shutdown_callback(close_rag_system)
+    # Stop the Supabase message batcher
+    ctx.add_shutdown_callback(close_supabase)
     
     # 2) Initialize session with memory capabilities
     userdata = {
@@ -82,12 +136,16 @@ async def entrypoint(ctx: JobContext):
         "agents": Agents(),
         "session_history": SessionHistory(
             session_start=datetime.now().isoformat(),
-            actions=[],
-            last_agent=None,
-            last_action_time=None
         ),
     }
     
+    # Close the Cal.com HTTP session shared by the agents when the call ends
+    async def close_http_session():
+        http = userdata.get("http")
+        if http is not None and not http.closed:
+            await http.close()
+    ctx.add_shutdown_callback(close_http_session)
+    
     # Enhanced session logging
     session_time = userdata['session_history'].session_start
     print(f"📅 Piscinik Session Started: {session_time}")
@@ -146,4 +204,5 @@ async def entrypoint(ctx: JobContext):
         on_enter_task.cancel()
 
 if __name__ == "__main__":
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
+    setup_logging()
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
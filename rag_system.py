@@ -1,16 +1,68 @@
 # rag_system.py - Système RAG pour Piscinik (VERSION PROPRE)
+import csv
+import hashlib
+import importlib.util
 import os
+import tempfile
 import numpy as np
-import pandas as pd
 import faiss
+import httpx
+import pyarrow as pa
+import pyarrow.parquet as pq
 from typing import List, Tuple
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
 import asyncio
+import time
+from collections import OrderedDict
 from pathlib import Path
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Prompt système constant (aucune interpolation) : le préfixe reste identique
+# octet pour octet, ce qui permet le cache de prompt automatique d'OpenAI
+SYSTEM_PROMPT = """Tu es l'expert technique de Piscinik. Réponds aux questions en te basant 
+STRICTEMENT sur le contexte fourni. Sois CONCIS, précis et pratique. 
+Donne 2-3 conseils concrets maximum, sans détails inutiles. Évite les longs paragraphes.
+Si l'information n'est pas dans le contexte, dis-le brièvement."""
+
+class SemanticAnswerCache:
+    """Cache des réponses générées, indexé par l'embedding normalisé de la question.
+    Une question assez proche (cosinus >= threshold) d'une question déjà traitée
+    reçoit la même réponse sans recherche ni appel au LLM."""
+
+    def __init__(self, dim: int, max_size: int = 1000, threshold: float = 0.95, ttl: float = 24 * 3600):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._answers: List[str | None] = [None] * max_size
+        self._expires = np.zeros(max_size)  # 0 = emplacement libre
+        self._last_used = np.zeros(max_size)
+
+    def get(self, query_embedding: np.ndarray) -> str | None:
+        now = time.monotonic()
+        live = self._expires > now
+        if not live.any():
+            return None
+        scores = self._vectors @ query_embedding[0]
+        scores[~live] = -1.0
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        self._last_used[best] = now
+        return self._answers[best]
+
+    def put(self, query_embedding: np.ndarray, answer: str):
+        now = time.monotonic()
+        free = np.flatnonzero(self._expires <= now)
+        # Emplacement libre ou expiré, sinon le moins récemment utilisé (LRU)
+        slot = int(free[0]) if free.size else int(self._last_used.argmin())
+        self._vectors[slot] = query_embedding[0]
+        self._answers[slot] = answer
+        self._expires[slot] = now + self.ttl
+        self._last_used[slot] = now
+
+
 class PiscinikRAG:
     def __init__(self, data_dir: str = "rag_data"):
         self.data_dir = Path(data_dir)
@@ -18,23 +70,72 @@ class PiscinikRAG:
         
         # Fichiers
         self.csv_path = self.data_dir / "piscinik_knowledge.csv"
+        self.chunks_path = self.data_dir / "chunks.parquet"
         self.embeddings_path = self.data_dir / "embeddings.npy"
         self.index_path = self.data_dir / "faiss_index.bin"
+        self.sq_index_path = self.data_dir / "faiss_index_sq8.bin"
+        self.query_cache_path = self.data_dir / "query_cache.npz"
         
-        # OpenAI client
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # OpenAI client - keep-alive longue et HTTP/2 (si le paquet h2 est
+        # installé) pour réutiliser la même connexion TLS entre les tours de
+        # parole (embeddings + chat)
+        self.client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_keepalive_connections=8,
+                    max_connections=32,
+                    keepalive_expiry=300,
+                ),
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                http2=importlib.util.find_spec("h2") is not None,
+            ),
+        )
         self.embedding_model = "text-embedding-3-small"
         self.embedding_dim = 1536  # Dimension pour text-embedding-3-small
+        self.embedding_concurrency = 8  # Batches d'embeddings simultanés
+        self.embedding_max_retries = 5
+        
+        # Score minimal (cosine) d'un chunk retenu - baissé de 0.7 à 0.5 pour plus de résultats
+        self.score_threshold = 0.5
+        
+        # Paramètres HNSW (recherche approximative sous-linéaire)
+        self.hnsw_m = 32
+        self.hnsw_ef_construction = 200
+        self.hnsw_ef_search = 64
+        
+        # En dessous de ce nombre de chunks, un produit matriciel NumPy est plus
+        # rapide que FAISS (pas de franchissement de frontière Python/C++ ni de graphe)
+        self.matrix_search_max = 1024
+        self._matrix: np.ndarray | None = None  # (N, d) normalisée, petit corpus uniquement
         
         # FAISS index et données
-        self.index = None
+        self.index = None  # Index FP32 (chargé seulement en repli s'il existe un index int8)
+        self.sq_index = None  # Index int8 (QT_8bit), utilisé par défaut
         self.chunks = []
         self.initialized = False
+        # Sérialise l'initialisation et la création différée (warm() en tâche de
+        # fond + première question ne doivent pas construire l'index deux fois)
+        self._init_lock = asyncio.Lock()
+        
+        # Cache LRU des embeddings de requêtes (évite un appel OpenAI par recherche),
+        # indexé par un hash de la requête : le texte des appelants n'est pas conservé
+        self._query_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.query_cache_size = 512
+        
+        # Cache sémantique des réponses (questions quasi identiques)
+        self._answer_cache = SemanticAnswerCache(self.embedding_dim)
         
     async def initialize(self):
         """Initialise le système RAG (embeddings une seule fois)"""
         if self.initialized:
             return
+        async with self._init_lock:
+            if not self.initialized:
+                await self._initialize()
+    
+    async def _initialize(self):
+        self._load_query_cache()
             
         try:
             if self._files_exist():
@@ -65,15 +166,129 @@ class PiscinikRAG:
         """Charge l'index existant (rapide)"""
         logger.info("📂 Chargement de l'index RAG existant...")
         
-        # Charger les chunks
-        df = pd.read_csv(self.csv_path)
-        self.chunks = df['content'].tolist()
+        # Charger les chunks (parquet colonnaire, sans tokenizer CSV)
+        if self.chunks_path.exists():
+            self.chunks = pq.read_table(
+                self.chunks_path, columns=['content']
+            ).column('content').to_pylist()
+        else:
+            # Index créé avant le format parquet : migrer depuis le CSV
+            self.chunks = self._read_csv_chunks()
+            self._save_chunks()
         
-        # Charger l'index FAISS
-        self.index = faiss.read_index(str(self.index_path))
+        # Petit corpus : recherche NumPy directe, les index FAISS ne sont pas chargés
+        if len(self.chunks) < self.matrix_search_max:
+            self._matrix = np.load(self.embeddings_path)
+        # Index int8 par défaut (4× plus compact), FP32 si absent (ancien format)
+        elif self.sq_index_path.exists():
+            self.sq_index = self._read_index(self.sq_index_path)
+        else:
+            self.index = self._read_index(self.index_path)
         
         logger.info(f"✅ Index chargé : {len(self.chunks)} chunks")
     
+    def _read_index(self, path: Path):
+        """Charge un index FAISS. IO_FLAG_MMAP ne concerne que les listes inversées
+        des index IVF : un index HNSW est désérialisé en mémoire. Les versions
+        récentes de FAISS (IO_FLAG_MMAP_IFC) mappent les codes sans les copier
+        quand le type d'index le permet ; sinon lecture complète."""
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        index = faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = self.hnsw_ef_search
+        return index
+    
+    def _search_matrix(self, query_embedding: np.ndarray, top_k: int):
+        """Recherche exacte par produit matriciel (mêmes formes de retour que FAISS)"""
+        scores = self._matrix @ query_embedding[0]
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top][None, :], top[None, :]
+    
+    def _search_index(self, query_embedding: np.ndarray, top_k: int):
+        """Recherche dans l'index int8, avec repli sur l'index FP32 si besoin"""
+        if self.sq_index is not None:
+            scores, indices = self.sq_index.search(query_embedding, top_k)
+            # Résultats manquants (-1) : la quantification a dégradé la recherche
+            if (indices[0] >= 0).all():
+                return scores, indices
+            logger.warning("⚠️ Résultats int8 incomplets - repli sur l'index FP32")
+        if self.index is None:
+            self.index = self._read_index(self.index_path)
+        return self.index.search(query_embedding, top_k)
+    
+    def _read_csv_chunks(self) -> List[str]:
+        """Lit la colonne 'content' du CSV de connaissances (sans pandas)"""
+        with open(self.csv_path, newline='', encoding='utf-8') as f:
+            return [row['content'] for row in csv.DictReader(f)]
+    
+    def _save_chunks(self):
+        """Sauvegarde les chunks au format parquet pour un chargement rapide"""
+        pq.write_table(pa.table({'content': self.chunks}), self.chunks_path)
+    
+    def _load_query_cache(self):
+        """Recharge le cache des embeddings de requêtes (redémarrage à chaud)"""
+        if not self.query_cache_path.exists():
+            return
+        try:
+            with np.load(self.query_cache_path) as data:
+                # Ancien format (questions en clair) : ignoré, écrasé à la prochaine sauvegarde
+                if "keys" not in data:
+                    return
+                for key, vector in zip(data["keys"].tolist(), data["vectors"]):
+                    self._query_cache[key] = vector.reshape(1, -1)
+            logger.info(f"📂 Cache de requêtes chargé : {len(self._query_cache)} entrées")
+        except Exception as e:
+            logger.warning(f"⚠️ Cache de requêtes illisible, ignoré : {e}")
+            self._query_cache.clear()
+    
+    def save_query_cache(self):
+        """Sauvegarde le cache des embeddings de requêtes sur disque (écriture
+        dans un fichier temporaire puis remplacement atomique)"""
+        if not self._query_cache:
+            return
+        # Fichier temporaire unique : plusieurs processus de job partagent rag_data/
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix="query_cache.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    keys=np.array(list(self._query_cache.keys())),
+                    vectors=np.concatenate(list(self._query_cache.values())),
+                )
+            os.replace(tmp_path, self.query_cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logger.info(f"💾 Cache de requêtes sauvegardé : {len(self._query_cache)} entrées")
+    
+    @staticmethod
+    def _query_key(query: str) -> str:
+        """Clé du cache de requêtes : SHA-256 de la requête normalisée"""
+        return hashlib.sha256(query.strip().lower().encode()).hexdigest()
+    
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """Retourne l'embedding normalisé de la requête (avec cache LRU)"""
+        key = self._query_key(query)
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            self._query_cache.move_to_end(key)
+            return cached
+        
+        response = await self.client.embeddings.create(
+            model=self.embedding_model,
+            input=[query]
+        )
+        
+        query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
+        faiss.normalize_L2(query_embedding)
+        
+        self._query_cache[key] = query_embedding
+        if len(self._query_cache) > self.query_cache_size:
+            self._query_cache.popitem(last=False)
+        return query_embedding
+    
     async def _create_embeddings(self):
         """Crée les embeddings (une seule fois)"""
         if not self.csv_path.exists():
@@ -81,88 +296,137 @@ class PiscinikRAG:
         
         logger.info("🚀 Création des embeddings (première fois)...")
         
-        # Lire le CSV
-        df = pd.read_csv(self.csv_path)
-        self.chunks = df['content'].tolist()
+        # Lire le CSV (self.chunks n'est publié qu'une fois l'index prêt, pour
+        # qu'une recherche concurrente ne voie pas de chunks sans index)
+        chunks = self._read_csv_chunks()
         
-        # Créer les embeddings par batch
-        embeddings = []
+        # Créer les embeddings par batch, plusieurs batches en parallèle
         batch_size = 20  # Plus petit pour éviter les rate limits
+        batches = [
+            chunks[i:i + batch_size]
+            for i in range(0, len(chunks), batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.embedding_concurrency)
+        done = 0
+        
+        # Une seule allocation contiguë, remplie batch par batch
+        embeddings_array = np.empty((len(chunks), self.embedding_dim), dtype=np.float32)
         
-        for i in range(0, len(self.chunks), batch_size):
-            batch = self.chunks[i:i + batch_size]
+        async def _embed(start: int, batch: List[str]):
+            nonlocal done
+            async with semaphore:
+                for attempt in range(self.embedding_max_retries):
+                    try:
+                        response = await self.client.embeddings.create(
+                            model=self.embedding_model,
+                            input=batch
+                        )
+                        break
+                    except RateLimitError:
+                        # Backoff exponentiel sur les 429
+                        if attempt == self.embedding_max_retries - 1:
+                            raise
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+                    except Exception as e:
+                        logger.error(f"Erreur création embeddings batch {start}: {e}")
+                        raise
             
-            try:
-                response = await self.client.embeddings.create(
-                    model=self.embedding_model,
-                    input=batch
-                )
-                
-                batch_embeddings = [data.embedding for data in response.data]
-                embeddings.extend(batch_embeddings)
-                
-                logger.info(f"📊 Embeddings créés : {len(embeddings)}/{len(self.chunks)}")
-                
-                # Pause pour respecter les rate limits
-                if i + batch_size < len(self.chunks):
-                    await asyncio.sleep(0.2)
-                    
-            except Exception as e:
-                logger.error(f"Erreur création embeddings batch {i}: {e}")
-                raise
+            embeddings_array[start:start + len(batch)] = np.asarray(
+                [data.embedding for data in response.data], dtype=np.float32
+            )
+            done += len(batch)
+            logger.info(f"📊 Embeddings créés : {done}/{len(chunks)}")
         
-        # Créer l'index FAISS
-        embeddings_array = np.array(embeddings, dtype=np.float32)
+        # Chaque batch écrit à sa position : l'ordre des chunks est conservé
+        await asyncio.gather(
+            *(_embed(i * batch_size, batch) for i, batch in enumerate(batches))
+        )
         
-        # Normaliser pour cosine similarity
+        # Créer l'index FAISS
+        # Normaliser pour cosine similarity (une seule fois : les vecteurs
+        # sauvegardés sont déjà normalisés, rien à refaire au chargement)
         faiss.normalize_L2(embeddings_array)
         
-        # Créer l'index
-        self.index = faiss.IndexFlatIP(self.embedding_dim)
+        # Créer l'index HNSW (produit scalaire = cosine sur vecteurs normalisés)
+        self.index = faiss.IndexHNSWFlat(
+            self.embedding_dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT
+        )
+        self.index.hnsw.efConstruction = self.hnsw_ef_construction
+        self.index.hnsw.efSearch = self.hnsw_ef_search
         self.index.add(embeddings_array)
         
-        # Sauvegarder
+        # Même graphe HNSW sur des vecteurs quantifiés int8 (¼ de la mémoire)
+        self.sq_index = faiss.IndexHNSWSQ(
+            self.embedding_dim,
+            faiss.ScalarQuantizer.QT_8bit,
+            self.hnsw_m,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        self.sq_index.hnsw.efConstruction = self.hnsw_ef_construction
+        self.sq_index.hnsw.efSearch = self.hnsw_ef_search
+        self.sq_index.train(embeddings_array)
+        self.sq_index.add(embeddings_array)
+        
+        # Sauvegarder (les vecteurs FP32 restent disponibles pour reconstruire l'index)
         np.save(self.embeddings_path, embeddings_array)
         faiss.write_index(self.index, str(self.index_path))
+        faiss.write_index(self.sq_index, str(self.sq_index_path))
+        self.chunks = chunks
+        self._save_chunks()
+        
+        if len(chunks) < self.matrix_search_max:
+            self._matrix = embeddings_array
         
         logger.info("✅ Embeddings créés et sauvegardés")
     
+    async def warm(self):
+        """Fait une recherche factice pour charger les chunks et l'index avant la
+        première vraie question"""
+        await self.search_embedding(np.zeros((1, self.embedding_dim), dtype=np.float32), top_k=1)
+    
     async def search(self, query: str, top_k: int = 3) -> List[Tuple[str, float]]:
         """Recherche les chunks les plus pertinents"""
+        logger.info(f"🔍 Recherche RAG pour: '{query}'")
+        try:
+            query_embedding = await self._embed_query(query)
+        except Exception as e:
+            logger.error(f"❌ Erreur recherche RAG: {e}")
+            return []
+        return await self.search_embedding(query_embedding, top_k)
+    
+    async def search_embedding(self, query_embedding: np.ndarray, top_k: int = 3) -> List[Tuple[str, float]]:
+        """Recherche les chunks les plus proches d'un embedding déjà calculé"""
         if not self.initialized:
             await self.initialize()
         
         # Si pas de chunks, créer les embeddings maintenant
         if not self.chunks and self.csv_path.exists():
-            logger.info("🚀 Création différée des embeddings...")
-            await self._create_embeddings()
+            async with self._init_lock:
+                if not self.chunks:
+                    logger.info("🚀 Création différée des embeddings...")
+                    await self._create_embeddings()
         
         if not self.chunks:
             logger.warning("⚠️ Aucun chunk disponible")
             return []
         
         try:
-            logger.info(f"🔍 Recherche RAG pour: '{query}'")
-            
-            # Créer l'embedding de la query
-            response = await self.client.embeddings.create(
-                model=self.embedding_model,
-                input=[query]
-            )
-            
-            query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
-            faiss.normalize_L2(query_embedding)
-            
             # Rechercher
-            scores, indices = self.index.search(query_embedding, top_k)
+            if self._matrix is not None:
+                scores, indices = self._search_matrix(query_embedding, top_k)
+            else:
+                scores, indices = self._search_index(query_embedding, top_k)
             
-            # Retourner les résultats
-            results = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if 0 <= idx < len(self.chunks):
-                    chunk = self.chunks[idx]
-                    results.append((chunk, float(score)))
-                    logger.info(f"📄 Résultat {i+1} (score: {score:.3f}): {chunk[:100]}...")
+            # Retourner les résultats (filtrage des indices invalides en un masque)
+            ix = indices[0]
+            valid = (ix >= 0) & (ix < len(self.chunks))
+            results = list(zip(
+                (self.chunks[i] for i in ix[valid].tolist()),
+                scores[0][valid].tolist(),
+            ))
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, (chunk, score) in enumerate(results):
+                    logger.debug("📄 Résultat %d (score: %.3f): %s...", i + 1, score, chunk[:100])
             
             logger.info(f"✅ {len(results)} chunks trouvés pour la recherche")
             return results
@@ -171,58 +435,69 @@ class PiscinikRAG:
             logger.error(f"❌ Erreur recherche RAG: {e}")
             return []
     
+    async def generate(self, relevant_chunks: List[Tuple[str, float]], query: str) -> str:
+        """Génère la réponse du LLM à partir des chunks retrouvés"""
+        if not relevant_chunks:
+            logger.warning("⚠️ Aucun chunk trouvé")
+            return "Je n'ai pas trouvé d'information spécifique sur ce sujet dans ma base de connaissances."
+        
+        # Construire le contexte
+        context_parts = [
+            chunk for chunk, score in relevant_chunks if score > self.score_threshold
+        ]
+        if logger.isEnabledFor(logging.DEBUG):
+            for _, score in relevant_chunks:
+                if score > self.score_threshold:
+                    logger.debug("✅ Chunk retenu (score: %.3f)", score)
+                else:
+                    logger.debug("❌ Chunk rejeté (score: %.3f) - seuil trop bas", score)
+        
+        if not context_parts:
+            logger.warning("⚠️ Aucun chunk au-dessus du seuil %s", self.score_threshold)
+            # Prendre au moins le meilleur résultat
+            context_parts = [relevant_chunks[0][0]]
+            logger.info(f"🔄 Utilisation du meilleur résultat (score: {relevant_chunks[0][1]:.3f})")
+        
+        context = "\n\n".join(context_parts)
+        logger.info(f"📝 Contexte construit avec {len(context_parts)} chunks")
+        
+        # Générer la réponse
+        response = await self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                # Préfixe identique à chaque appel → cache de prompt OpenAI
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {
+                    "role": "user", 
+                    "content": f"Contexte technique :\n{context}\n\nQuestion client : {query}\n\nRéponse courte et pratique :"
+                }
+            ],
+            temperature=0,  # Déterministe pour les réponses techniques
+            max_tokens=150  # Réduit de 300 à 150 tokens pour des réponses plus courtes
+        )
+        
+        final_answer = response.choices[0].message.content
+        logger.info(f"🎯 Réponse générée: {final_answer}")
+        return final_answer
+    
     async def get_answer(self, query: str) -> str:
         """Génère une réponse basée sur la recherche RAG"""
         try:
             logger.info(f"🤖 Génération réponse pour: '{query}'")
             
-            # Rechercher les chunks pertinents
-            relevant_chunks = await self.search(query, top_k=3)
-            
-            if not relevant_chunks:
-                logger.warning("⚠️ Aucun chunk trouvé")
-                return "Je n'ai pas trouvé d'information spécifique sur ce sujet dans ma base de connaissances."
-            
-            # Construire le contexte
-            context_parts = []
-            for chunk, score in relevant_chunks:
-                if score > 0.5:  # Seuil baissé de 0.7 à 0.5 pour plus de résultats
-                    context_parts.append(chunk)
-                    logger.info(f"✅ Chunk retenu (score: {score:.3f})")
-                else:
-                    logger.info(f"❌ Chunk rejeté (score: {score:.3f}) - seuil trop bas")
-            
-            if not context_parts:
-                logger.warning("⚠️ Aucun chunk au-dessus du seuil 0.5")
-                # Prendre au moins le meilleur résultat
-                context_parts = [relevant_chunks[0][0]]
-                logger.info(f"🔄 Utilisation du meilleur résultat (score: {relevant_chunks[0][1]:.3f})")
-            
-            context = "\n\n".join(context_parts)
-            logger.info(f"📝 Contexte construit avec {len(context_parts)} chunks")
-            
-            # Générer la réponse
-            response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": """Tu es l'expert technique de Piscinik. Réponds aux questions en te basant 
-                        STRICTEMENT sur le contexte fourni. Sois CONCIS, précis et pratique. 
-                        Donne 2-3 conseils concrets maximum, sans détails inutiles. Évite les longs paragraphes.
-                        Si l'information n'est pas dans le contexte, dis-le brièvement."""
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"Contexte technique :\n{context}\n\nQuestion client : {query}\n\nRéponse courte et pratique :"
-                    }
-                ],
-                temperature=0.3,  # Plus déterministe pour les réponses techniques
-                max_tokens=150  # Réduit de 300 à 150 tokens pour des réponses plus courtes
-            )
+            # Question déjà traitée (ou presque) : réponse depuis le cache sémantique
+            query_embedding = await self._embed_query(query)
+            cached_answer = self._answer_cache.get(query_embedding)
+            if cached_answer is not None:
+                logger.info("⚡ Réponse servie depuis le cache sémantique")
+                return cached_answer
             
-            final_answer = response.choices[0].message.content
-            logger.info(f"🎯 Réponse générée: {final_answer}")
+            # Rechercher les chunks pertinents puis générer
+            relevant_chunks = await self.search_embedding(query_embedding, top_k=3)
+            final_answer = await self.generate(relevant_chunks, query)
+            # Seules les vraies réponses du LLM sont mises en cache
+            if relevant_chunks and final_answer:
+                self._answer_cache.put(query_embedding, final_answer)
             
             return final_answer
             
@@ -243,6 +518,15 @@ async def get_rag_system() -> PiscinikRAG:
     return _rag_instance
 
 
+async def close_rag_system():
+    """Persiste le cache de requêtes de l'instance RAG si elle existe"""
+    if _rag_instance is not None:
+        try:
+            _rag_instance.save_query_cache()
+        except Exception as e:
+            logger.error(f"❌ Erreur sauvegarde cache de requêtes: {e}")
+
+
 # Test du système
 async def test_rag():
     """Test du système RAG"""
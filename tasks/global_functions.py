@@ -1,24 +1,49 @@
 # tasks/global_functions.py
+import re
+import time
 from datetime import date, datetime, timedelta
+from itertools import islice
 from typing import Annotated
 from pydantic import Field
 from livekit.agents.llm import function_tool
 from livekit.agents.voice import Agent, RunContext
 
+# Numéros de jour dans une date en français (ex: "17 juin")
+_DATE_NUM_RE = re.compile(r'\b(\d{1,2})\b')
+# Mots d'une description de date (ponctuation ignorée)
+_WORD_RE = re.compile(r'\w+')
+# Heure explicite (ex: "10h", "14h30", "9:00")
+_HOUR_RE = re.compile(r'(\d{1,2})\s*[h:]')
+
+# Actions de rendez-vous recherchées par check_recent_appointment
+_APPT_ACTIONS = frozenset({"appointment_scheduled", "appointment_cancelled", "appointment_rescheduled"})
+
+_WEEKDAY_FR = ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche')
+_WEEKDAY_IDX = {name: i for i, name in enumerate(_WEEKDAY_FR)}  # 0=lundi, ..., 6=dimanche
+_MONTH_FR = (
+    '', 'janvier', 'février', 'mars', 'avril', 'mai', 'juin',
+    'juillet', 'août', 'septembre', 'octobre', 'novembre', 'décembre',
+)
+
+# Champ demandé par le LLM → attribut de UserInfo
+_FIELD_MAP = {
+    "name": "name",
+    "phone_number": "phone",
+    "email": "email",
+    "pool_type": "pool_type",
+    "pool_size": "pool_size",
+}
+
 # ===== FONCTIONS DE MÉMOIRE DE SESSION =====
 
-@function_tool()
-async def log_action(
-    agent_name: Annotated[str, Field(description="Nom de l'agent qui effectue l'action")],
-    action_type: Annotated[str, Field(description="Type d'action : 'appointment_scheduled', 'appointment_cancelled', 'message_sent', 'technical_advice', etc.")],
-    details: Annotated[str, Field(description="Détails de l'action au format JSON ou texte descriptif")],
-    context: RunContext,
-) -> dict:
-    """Enregistre une action dans l'historique de session pour éviter les redondances."""
-    session_history = context.userdata["session_history"]
-    
+def _record_action(session_history, agent_name: str, action_type: str, details: str) -> dict:
+    """Ajoute une action à l'historique de session et retourne l'entrée créée.
+    Les agents l'appellent directement, sans passer par l'outil log_action."""
+    now = datetime.now()
     action_entry = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now.isoformat(),
+        "ts_epoch": now.timestamp(),  # Pour les calculs de délai sans reparser
+        "hhmm": now.strftime("%H:%M"),  # Pour l'affichage sans reformater
         "agent": agent_name,
         "action": action_type,
         "details": details
@@ -29,11 +54,18 @@ async def log_action(
     session_history.last_agent = agent_name
     session_history.last_action_time = action_entry["timestamp"]
     
-    # Limiter l'historique aux 10 dernières actions pour optimiser la performance
-    if len(session_history.actions) > 10:
-        session_history.actions = session_history.actions[-10:]
-    
     print(f"DEBUG: Action logged - {agent_name}: {action_type}")
+    return action_entry
+
+@function_tool()
+async def log_action(
+    agent_name: Annotated[str, Field(description="Nom de l'agent qui effectue l'action")],
+    action_type: Annotated[str, Field(description="Type d'action : 'appointment_scheduled', 'appointment_cancelled', 'message_sent', 'technical_advice', etc.")],
+    details: Annotated[str, Field(description="Détails de l'action au format JSON ou texte descriptif")],
+    context: RunContext,
+) -> dict:
+    """Enregistre une action dans l'historique de session pour éviter les redondances."""
+    _record_action(context.userdata["session_history"], agent_name, action_type, details)
     return {"message": f"Action enregistrée : {action_type}"}
 
 @function_tool()
@@ -47,16 +79,18 @@ async def get_recent_actions(
     if not session_history.actions:
         return {"summary": "Aucune action récente dans cette session."}
     
-    # Récupérer les dernières actions
-    recent_actions = session_history.actions[-limit:]
+    # Récupérer les dernières actions (un deque ne se découpe pas en tranches) ;
+    # limit vient du modèle : 0 ou négatif = toutes, comme l'ancien actions[-limit:]
+    limit = max(limit, 0) or len(session_history.actions)
+    recent_actions = list(islice(reversed(session_history.actions), limit))[::-1]
     
-    summary = "Actions récentes dans cette session :\n"
-    for action in recent_actions:
-        timestamp = datetime.fromisoformat(action["timestamp"])
-        time_str = timestamp.strftime("%H:%M")
-        summary += f"- {time_str} | {action['agent']} : {action['action']} - {action['details']}\n"
+    lines = ["Actions récentes dans cette session :"]
+    lines.extend(
+        f"- {action['hhmm']} | {action['agent']} : {action['action']} - {action['details']}"
+        for action in recent_actions
+    )
     
-    return {"summary": summary.strip()}
+    return {"summary": "\n".join(lines)}
 
 @function_tool()
 async def check_recent_appointment(
@@ -67,9 +101,9 @@ async def check_recent_appointment(
     
     # Chercher la dernière action de type appointment
     for action in reversed(session_history.actions):
-        if action["action"] in ["appointment_scheduled", "appointment_cancelled", "appointment_rescheduled"]:
+        if action["action"] in _APPT_ACTIONS:
             return {
-                "appointment": f"Dernier RDV : {action['action']} - {action['details']} (à {datetime.fromisoformat(action['timestamp']).strftime('%H:%M')})"
+                "appointment": f"Dernier RDV : {action['action']} - {action['details']} (à {action['hhmm']})"
             }
 
     return {"appointment": None}
@@ -80,7 +114,7 @@ async def clear_session_history(
 ) -> dict:
     """Remet à zéro l'historique de session (utile pour les tests ou nouveau client)."""
     session_history = context.userdata["session_history"]
-    session_history.actions = []
+    session_history.actions.clear()
     session_history.last_agent = None
     session_history.last_action_time = None
     
@@ -88,33 +122,48 @@ async def clear_session_history(
 
 # ===== FONCTIONS EXISTANTES =====
 
-@function_tool()
+# Outil appelé après la plupart des tours : schéma JSON écrit à la main pour que
+# le framework ne reconstruise pas un modèle pydantic à chaque appel
+_UPDATE_INFORMATION_SCHEMA = {
+    "name": "update_information",
+    "description": "Met à jour les informations enregistrées sur l'utilisateur et renvoie un message contextuel.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "field": {
+                "type": "string",
+                "description": """Le type d'information à mettre à jour,
+            parmi 'phone_number', 'email', 'name', 'pool_type', ou 'pool_size'""",
+            },
+            "info": {
+                "type": "string",
+                "description": "La nouvelle information fournie par l'utilisateur",
+            },
+        },
+        "required": ["field", "info"],
+    },
+}
+
+@function_tool(raw_schema=_UPDATE_INFORMATION_SCHEMA)
 async def update_information(
-    field: Annotated[
-        str,
-        Field(
-            description="""Le type d'information à mettre à jour,
-            parmi 'phone_number', 'email', 'name', 'pool_type', ou 'pool_size'"""
-        ),
-    ],
-    info: Annotated[str, Field(description="La nouvelle information fournie par l'utilisateur")],
+    raw_arguments: dict[str, object],
     context: RunContext,
 ) -> dict:
     """Met à jour les informations enregistrées sur l'utilisateur et renvoie un message contextuel."""
+    field = str(raw_arguments.get("field") or "").strip()
+    info = str(raw_arguments.get("info") or "").strip()
+    # Le schéma brut n'est pas validé : signaler explicitement au modèle un
+    # argument manquant plutôt que d'enregistrer une valeur vide
+    if not field or not info:
+        return {"error": "Les arguments 'field' et 'info' sont requis et ne doivent pas être vides."}
+    attr = _FIELD_MAP.get(field)
+    if attr is None:
+        return {"error": f"Champ inconnu '{field}' : utilisez {', '.join(_FIELD_MAP)}."}
     userinfo = context.userdata["userinfo"]
     session_history = context.userdata["session_history"]
     
     # Mettre à jour l'information
-    if field == "name":
-        userinfo.name = info
-    elif field == "phone_number":
-        userinfo.phone = info
-    elif field == "email":
-        userinfo.email = info
-    elif field == "pool_type":
-        userinfo.pool_type = info
-    elif field == "pool_size":
-        userinfo.pool_size = info
+    setattr(userinfo, attr, info)
     
     # 🎯 CORRECTION : Message contextuel selon l'historique récent
     recent_appointment = None
@@ -126,10 +175,7 @@ async def update_information(
     # Si un RDV vient d'être planifié ET qu'on met à jour l'email
     if recent_appointment and field == "email":
         # Vérifier que le RDV est très récent (moins de 2 minutes)
-        from datetime import datetime
-        action_time = datetime.fromisoformat(recent_appointment["timestamp"])
-        now = datetime.now()
-        time_diff = (now - action_time).total_seconds()
+        time_diff = time.time() - recent_appointment["ts_epoch"]
         
         if time_diff < 120:  # Moins de 2 minutes
             return {
@@ -154,18 +200,9 @@ async def get_user_info(
 ) -> dict:
     """Récupère les informations enregistrées sur l'utilisateur."""
     userinfo = context.userdata["userinfo"]
-    if field == "name" and userinfo.name:
-        return {"value": userinfo.name}
-    elif field == "phone_number" and userinfo.phone:
-        return {"value": userinfo.phone}
-    elif field == "email" and userinfo.email:
-        return {"value": userinfo.email}
-    elif field == "pool_type" and userinfo.pool_type:
-        return {"value": userinfo.pool_type}
-    elif field == "pool_size" and userinfo.pool_size:
-        return {"value": userinfo.pool_size}
-    else:
-        return {"value": None}
+    attr = _FIELD_MAP.get(field)
+    value = getattr(userinfo, attr, None) if attr else None
+    return {"value": value or None}
 
 @function_tool()
 async def transfer_to_receptionist(context: RunContext) -> tuple[Agent, str]:
@@ -217,13 +254,13 @@ async def get_current_datetime_info() -> dict:
     now = datetime.now()
     today = now.date()  # Date système réelle
     
-    # Calculer les jours de la semaine dynamiquement
-    weekday_names = ['lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi', 'dimanche']
-    current_weekday = weekday_names[today.weekday()]
+    # Noms français indépendants de la locale (strftime('%B') peut être en anglais)
+    weekday = today.weekday()
+    current_weekday = _WEEKDAY_FR[weekday]
     
-    date_info = f"""Date actuelle : {today.isoformat()} ({current_weekday} {today.day} {today.strftime('%B')} {today.year})
-Demain : {(today + timedelta(days=1)).isoformat()} ({weekday_names[(today.weekday() + 1) % 7]})
-Après-demain : {(today + timedelta(days=2)).isoformat()} ({weekday_names[(today.weekday() + 2) % 7]})
+    date_info = f"""Date actuelle : {today.isoformat()} ({current_weekday} {today.day} {_MONTH_FR[today.month]} {today.year})
+Demain : {(today + timedelta(days=1)).isoformat()} ({_WEEKDAY_FR[(weekday + 1) % 7]})
+Après-demain : {(today + timedelta(days=2)).isoformat()} ({_WEEKDAY_FR[(weekday + 2) % 7]})
 
 Heure actuelle : {now.strftime('%H:%M')}
 
@@ -233,6 +270,27 @@ Pour les rendez-vous, utilisez le format ISO 8601 UTC :
     
     return {"info": date_info}
 
+def _next_month(today: date, day_num: int) -> date:
+    """Même numéro de jour, le mois suivant (lève ValueError si invalide)."""
+    if today.month == 12:
+        return today.replace(year=today.year + 1, month=1, day=day_num)
+    return today.replace(month=today.month + 1, day=day_num)
+
+def _next_valid_date(today: date, day_num: int) -> date:
+    """Prochaine date portant ce numéro de jour : ce mois-ci s'il est à venir,
+    sinon le mois suivant, à défaut dans une semaine."""
+    try:
+        if day_num > today.day:
+            try:
+                return today.replace(day=day_num)
+            except ValueError:
+                # Jour invalide pour ce mois, utiliser le mois suivant
+                pass
+        return _next_month(today, day_num)
+    except ValueError:
+        # Si ça échoue, utiliser le calcul par défaut
+        return today + timedelta(days=7)
+
 @function_tool()
 async def convert_french_time_to_iso(
     date_description: Annotated[str, Field(description="Description de la date en français (ex: 'demain', 'mardi', '17 juin')")],
@@ -242,89 +300,48 @@ async def convert_french_time_to_iso(
     today = date.today()  # Date système RÉELLE
     current_weekday = today.weekday()  # 0=lundi, 1=mardi, ..., 6=dimanche
     
-    # Mapping des jours de la semaine
-    weekdays = {
-        'lundi': 0, 'mardi': 1, 'mercredi': 2, 'jeudi': 3, 
-        'vendredi': 4, 'samedi': 5, 'dimanche': 6
-    }
-    
     target_date = today
     date_lower = date_description.lower()
     
+    # Mots de la description (une recherche par hachage, sans sous-chaînes)
+    tokens = set(_WORD_RE.findall(date_lower))
+    found_day = next((_WEEKDAY_IDX[t] for t in tokens if t in _WEEKDAY_IDX), None)
+    
     # Gestion des expressions relatives simples
-    if "demain" in date_lower:
-        target_date = today + timedelta(days=1)
-    elif "après-demain" in date_lower or "aprés-demain" in date_lower:
+    # ("après-demain" d'abord : il contient "demain")
+    if "après-demain" in date_lower or "aprés-demain" in date_lower:
         target_date = today + timedelta(days=2)
+    elif "demain" in date_lower:
+        target_date = today + timedelta(days=1)
     elif "aujourd'hui" in date_lower or "aujourd hui" in date_lower:
         target_date = today
     
-    # Gestion dynamique des jours de la semaine
-    else:
-        found_day = None
-        is_next_week = "prochain" in date_lower or "prochaine" in date_lower
+    # Gestion dynamique des jours de la semaine (prioritaire sur "mardi 17")
+    elif found_day is not None:
+        is_next_week = "prochain" in tokens or "prochaine" in tokens
         
-        # Chercher le jour mentionné
-        for day_name, day_num in weekdays.items():
-            if day_name in date_lower:
-                found_day = day_num
-                break
+        # Calculer combien de jours jusqu'au prochain occurrence de ce jour
+        days_ahead = found_day - current_weekday
         
-        if found_day is not None:
-            # Calculer combien de jours jusqu'au prochain occurrence de ce jour
-            days_ahead = found_day - current_weekday
-            
-            if is_next_week or days_ahead <= 0:
-                # Si c'est "prochain" ou si le jour est déjà passé cette semaine
-                days_ahead += 7
-            
-            target_date = today + timedelta(days=days_ahead)
+        if is_next_week or days_ahead <= 0:
+            # Si c'est "prochain" ou si le jour est déjà passé cette semaine
+            days_ahead += 7
+        
+        target_date = today + timedelta(days=days_ahead)
     
     # Gestion des dates numériques (ex: "17 juin", "19")
-    import re
-    date_numbers = re.findall(r'\b(\d{1,2})\b', date_description)
-    if date_numbers:
-        day_num = int(date_numbers[0])
-        # Si le numéro est supérieur au jour actuel ce mois, l'utiliser
-        if day_num > today.day:
-            try:
-                target_date = today.replace(day=day_num)
-            except ValueError:
-                # Jour invalide pour ce mois, utiliser le mois suivant
-                if today.month == 12:
-                    target_date = today.replace(year=today.year + 1, month=1, day=day_num)
-                else:
-                    target_date = today.replace(month=today.month + 1, day=day_num)
-        elif day_num <= today.day:
-            # Jour dans le passé ce mois, essayer le mois suivant
-            try:
-                if today.month == 12:
-                    target_date = today.replace(year=today.year + 1, month=1, day=day_num)
-                else:
-                    target_date = today.replace(month=today.month + 1, day=day_num)
-            except ValueError:
-                # Si ça échoue, utiliser le calcul par défaut
-                target_date = today + timedelta(days=7)
+    elif date_numbers := _DATE_NUM_RE.findall(date_description):
+        target_date = _next_valid_date(today, int(date_numbers[0]))
     
     # Mapping des heures (France = UTC+1 en hiver, UTC+2 en été)
     # En juin, nous sommes en UTC+2 (heure d'été)
     hour_utc = 9  # Par défaut 11h Paris = 9h UTC
     time_lower = time_description.lower()
     
-    if "8h" in time_lower or "8:" in time_lower:
-        hour_utc = 6  # 8h Paris = 6h UTC
-    elif "9h" in time_lower or "9:" in time_lower:
-        hour_utc = 7  # 9h Paris = 7h UTC
-    elif "10h" in time_lower or "10:" in time_lower:
-        hour_utc = 8  # 10h Paris = 8h UTC
-    elif "11h" in time_lower or "11:" in time_lower:
-        hour_utc = 9  # 11h Paris = 9h UTC
-    elif "14h" in time_lower or "14:" in time_lower:
-        hour_utc = 12  # 14h Paris = 12h UTC
-    elif "15h" in time_lower or "15:" in time_lower:
-        hour_utc = 13  # 15h Paris = 13h UTC
-    elif "16h" in time_lower or "16:" in time_lower:
-        hour_utc = 14  # 16h Paris = 14h UTC
+    # Chemin rapide : heure explicite ("10h", "14h30", "9:00") → Paris - 2h
+    hour_match = _HOUR_RE.search(time_lower)
+    if hour_match and 2 <= int(hour_match.group(1)) <= 23:
+        hour_utc = int(hour_match.group(1)) - 2
     elif "matin" in time_lower:
         hour_utc = 8  # 10h Paris = 8h UTC
     elif "après-midi" in time_lower or "aprés-midi" in time_lower:
@@ -1,4 +1,5 @@
 # tasks/messenger_task.py
+import asyncio
 import os
 from typing import Annotated
 from pydantic import Field
@@ -13,30 +14,130 @@ from .global_functions import (
     update_information,
 )
 
+# Client Supabase partagé par toutes les instances de Messenger
+_supabase_client: "SupabaseClient | None" = None
+_supabase_lock = asyncio.Lock()
+
+# Regroupement des insertions : un message isolé part immédiatement ; pendant
+# une rafale, une requête pour au plus MAX_BATCH messages, envoyée au plus tard
+# MAX_WAIT secondes après le premier message en attente
+MAX_BATCH = 100
+MAX_WAIT = 0.5
+# À l'arrêt du job, délai laissé pour enregistrer les messages encore en file
+CLOSE_TIMEOUT = 5.0
+
 class SupabaseClient:
     def __init__(self, supabase: AsyncClient) -> None:
         self._supabase = supabase
+        self._pending: asyncio.Queue[tuple[dict, asyncio.Future]] = asyncio.Queue()
+        self._flusher: asyncio.Task | None = None
 
     @classmethod
-    async def initiate_supabase(supabase):
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_API_KEY")
-        supabase_client: AsyncClient = await create_async_client(url, key)
-        return supabase(supabase_client)
+    async def initiate_supabase(cls) -> "SupabaseClient":
+        global _supabase_client
+        async with _supabase_lock:
+            if _supabase_client is None:
+                url = os.getenv("SUPABASE_URL")
+                key = os.getenv("SUPABASE_API_KEY")
+                supabase_client: AsyncClient = await create_async_client(url, key)
+                _supabase_client = cls(supabase_client)
+            _supabase_client._start_flusher()
+            return _supabase_client
+
+    def _start_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            batch = [await self._pending.get()]
+            try:
+                await self._collect(batch)
+                await self._insert(batch)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            finally:
+                # Permet à close() d'attendre que tout ce qui est en file soit traité
+                for _ in batch:
+                    self._pending.task_done()
+
+    async def _collect(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        # Laisse les insertions lancées dans le même tour rejoindre la file
+        await asyncio.sleep(0)
+        deadline = loop.time() + MAX_WAIT
+        while len(batch) < MAX_BATCH:
+            if not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+                continue
+            if len(batch) == 1:
+                break  # Pas de rafale en cours : envoi sans attendre
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _insert(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            data = await (
+                self._supabase.table("messages")
+                .insert([row for row, _ in batch])
+                .execute()
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(data)
 
     async def insert_msg(self, name: str, message: str, phone: str, pool_info: str = None) -> list:
-        data = await (
-            self._supabase.table("messages")
-            .insert({
+        """Met le message en file et attend que son lot soit enregistré."""
+        future = asyncio.get_running_loop().create_future()
+        await self._pending.put((
+            {
                 "name": name, 
                 "message": message, 
                 "phone_number": phone,
                 "pool_info": pool_info,
                 "service_type": "piscinik"
-            })
-            .execute()
-        )
-        return data
+            },
+            future,
+        ))
+        self._start_flusher()
+        return await future
+
+    async def close(self) -> None:
+        """Enregistre les messages encore en file (lot en cours compris) puis
+        arrête la tâche de regroupement ; au-delà de CLOSE_TIMEOUT, les
+        insertions restantes sont annulées."""
+        if not self._pending.empty():
+            self._start_flusher()
+        try:
+            await asyncio.wait_for(self._pending.join(), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while not self._pending.empty():
+            _, future = self._pending.get_nowait()
+            self._pending.task_done()
+            future.cancel()
+
+
+async def close_supabase() -> None:
+    """Arrête le regroupement des insertions du client partagé s'il existe"""
+    if _supabase_client is not None:
+        await _supabase_client.close()
 
 class Messenger(Agent):
     def __init__(self) -> None:
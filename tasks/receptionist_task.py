@@ -1,6 +1,5 @@
 # tasks/receptionist_task.py - VERSION STRICTE
 from typing import Annotated
-from datetime import datetime
 from pydantic import Field
 from livekit.agents.llm import function_tool
 from livekit.agents import Agent, RunContext
@@ -11,7 +10,8 @@ from .global_functions import (
     transfer_to_technical_expert,
     get_recent_actions,
     check_recent_appointment,
-    log_action
+    log_action,
+    _record_action,
 )
 
 class Receptionist(Agent):
@@ -67,25 +67,18 @@ class Receptionist(Agent):
     async def on_enter(self) -> None:
         # Récupérer les informations client
         userinfo = self.session.userdata["userinfo"]
-        client_name = userinfo.name if userinfo.name else ""
+        client_name = userinfo.name or ""
         
         print(f"DEBUG Receptionist: Nom client: {client_name}")
         
-        # Message d'accueil simple et direct
-        if client_name:
-            greeting = f"Re-bonjour {client_name} ! Comment puis-je vous orienter aujourd'hui ? Souhaitez-vous planifier un rendez-vous, poser une question technique, ou laisser un message ?"
-        else:
-            greeting = "Bonjour et bienvenue chez Piscinik ! Je suis Julie, votre réceptionniste. Puis-je avoir votre nom et savoir comment vous orienter ? (rendez-vous, question technique, ou message)"
-        
-        # Enregistrer l'interaction d'accueil
-        session_history = self.session.userdata["session_history"]
-        action_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "agent": "receptionist",
-            "action": "customer_welcomed",
-            "details": f"Accueil {client_name if client_name else 'nouveau client'}"
-        }
-        session_history.actions.append(action_entry)
+        # Enregistrer l'interaction d'accueil (le message d'accueil lui-même est
+        # construit plus tard par greet_with_context, une fois le client entendu)
+        _record_action(
+            self.session.userdata["session_history"],
+            "receptionist",
+            "customer_welcomed",
+            f"Accueil {client_name or 'nouveau client'}"
+        )
         # Nova Sonic's realtime API does not allow generating speech before any
         # user audio has been received. Calling generate_reply here would
         # trigger an "unprompted generation" error at startup. Instead, the
@@ -161,11 +154,11 @@ class Receptionist(Agent):
             context.userdata["userinfo"].name = name
         
         # Enregistrer la demande de rendez-vous
-        await log_action(
-            "receptionist", 
+        _record_action(
+            context.userdata["session_history"],
+            "receptionist",
             f"appointment_request_{action}", 
-            f"Demande de {action} par {name}", 
-            context
+            f"Demande de {action} par {name}"
         )
         
         # Messages de transfert STRICTES - Aucune ambiguïté
@@ -193,11 +186,11 @@ class Receptionist(Agent):
             context.userdata["userinfo"].name = name
             
         # Enregistrer la demande de message
-        await log_action(
-            "receptionist", 
+        _record_action(
+            context.userdata["session_history"],
+            "receptionist",
             "message_request", 
-            f"Demande de message par {name}", 
-            context
+            f"Demande de message par {name}"
         )
         
         # TRANSFERT IMMÉDIAT
@@ -221,11 +214,11 @@ class Receptionist(Agent):
         client_name = userinfo.name
             
         # Enregistrer la demande technique
-        await log_action(
-            "receptionist", 
+        _record_action(
+            context.userdata["session_history"],
+            "receptionist",
             "technical_request", 
-            f"Question technique de {client_name}", 
-            context
+            f"Question technique de {client_name}"
         )
         
         # TRANSFERT IMMÉDIAT
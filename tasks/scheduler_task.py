@@ -1,9 +1,13 @@
 # tasks/scheduler_task.py - Version avec mémoire de session - CORRIGÉE
+import asyncio
+import logging
 import os
 from enum import Enum
+from time import monotonic
 from typing import Annotated
 
 import aiohttp
+import orjson
 from pydantic import Field
 
 from livekit.agents.llm import function_tool
@@ -19,10 +23,98 @@ from .global_functions import (
     transfer_to_technical_expert,
     update_information,
     log_action,
+    _record_action,
     get_recent_actions,
     check_recent_appointment,
 )
 
+logger = logging.getLogger(__name__)
+
+# En-têtes Cal.com construits une seule fois (échoue à l'import si la clé manque)
+_CAL_HEADERS = {
+    "cal-api-version": "2024-08-13",
+    "Authorization": f"Bearer {os.environ['CAL_API_KEY']}",
+}
+
+
+def get_http_session(userdata: dict) -> aiohttp.ClientSession:
+    """Retourne la session HTTP Cal.com de l'appel, partagée entre les agents
+    (pool de connexions et keep-alive réutilisés à chaque requête)."""
+    http = userdata.get("http")
+    if http is None or http.closed:
+        http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=32, limit_per_host=16, keepalive_timeout=75, ttl_dns_cache=300
+            ),
+            headers=_CAL_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=15),
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+        )
+        userdata["http"] = http
+    return http
+
+
+# Durée de validité des recherches de RDV par email (secondes)
+APPTS_CACHE_TTL = 30
+
+# Nombre de nouvelles tentatives après une réponse 429 de Cal.com
+CAL_MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Limiteur de débit côté client : au plus `burst` requêtes d'un coup,
+    puis `rate` requêtes par seconde."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+# Partagé par tous les appels du processus (quota Cal.com par clé API)
+_CAL_BUCKET = TokenBucket(rate=10, burst=20)
+
+
+def _retry_after(value: str | None, attempt: int) -> float:
+    """Délai d'attente avant un nouvel essai, d'après l'en-tête Retry-After
+    (en secondes) ou, à défaut, un backoff exponentiel."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 0.5 * 2 ** attempt
+
+
+# Libellés parlés des services, calculés une seule fois
+SERVICE_LABELS = {
+    slug: slug.replace("-", " ")
+    for slug in (
+        "diagnostic-piscine",
+        "entretien-piscine",
+        "reparation-piscine",
+        "installation-equipement",
+    )
+}
+SERVICE_LABELS["planifier"] = "votre service piscine"
+
+
+# Recherches anticipées en cours (référencées pour ne pas être collectées)
+_prefetch_tasks: set[asyncio.Task] = set()
+
 
 class APIRequests(Enum):
     GET_APPTS = "get_appts"
@@ -32,6 +124,199 @@ class APIRequests(Enum):
     GET_AVAILABILITY = "get_availability"
 
 
+_BOOKINGS_URL = "https://api.cal.com/v2/bookings"
+_SLOTS_URL = "https://api.cal.com/v2/slots/available"
+_CANCEL_PAYLOAD = {"cancellationReason": "Annulation demandée par le client"}
+
+
+# Constructeurs de requêtes Cal.com : chacun retourne (verbe, url, arguments)
+def _build_get_appts(scheduler, uid, time, slug, context):
+    userinfo = context.userdata["userinfo"]
+    return "get", _BOOKINGS_URL, {
+        "params": {
+            "attendeeEmail": userinfo.email,
+            "attendeeName": userinfo.name,
+            "status": "upcoming",
+        }
+    }
+
+
+def _build_get_availability(scheduler, uid, time, slug, context):
+    return "get", _SLOTS_URL, {
+        "params": {
+            "eventTypeId": scheduler._event_ids[slug],
+            "startTime": time,
+            "endTime": time,
+        }
+    }
+
+
+def _build_cancel(scheduler, uid, time, slug, context):
+    return "post", f"{_BOOKINGS_URL}/{uid}/cancel", {"json": _CANCEL_PAYLOAD}
+
+
+def _build_schedule(scheduler, uid, time, slug, context):
+    userinfo = context.userdata["userinfo"]
+    key = (userinfo.name, userinfo.email)
+    attendee_details = scheduler._attendee_cache.get(key)
+    if attendee_details is None:
+        attendee_details = scheduler._attendee_cache[key] = {
+            "name": userinfo.name,
+            "email": userinfo.email,
+            "timeZone": "Europe/Paris",
+        }
+
+    return "post", _BOOKINGS_URL, {
+        "json": {
+            "start": time,
+            "eventTypeId": scheduler._event_ids[slug],
+            "attendee": attendee_details,
+        }
+    }
+
+
+def _build_reschedule(scheduler, uid, time, slug, context):
+    return "post", f"{_BOOKINGS_URL}/{uid}/reschedule", {"json": {"start": time}}
+
+
+_BUILDERS = {
+    APIRequests.GET_APPTS: _build_get_appts,
+    APIRequests.GET_AVAILABILITY: _build_get_availability,
+    APIRequests.CANCEL: _build_cancel,
+    APIRequests.SCHEDULE: _build_schedule,
+    APIRequests.RESCHEDULE: _build_reschedule,
+}
+
+
+class Outcome(Enum):
+    SUCCESS = "success"
+    PAST_DATE = "past_date"
+    UNAVAILABLE = "unavailable"
+    API_ERROR = "api_error"
+    UNKNOWN = "unknown"
+
+
+# Motifs d'erreur Cal.com, comparés à la réponse sérialisée en minuscules
+_PAST_DATE_MARK = b"attempting to book a meeting in the past"
+_UNAVAILABLE_MARK = b"not available"
+
+
+def _classify(response) -> tuple[Outcome, str]:
+    """Classe une réponse Cal.com : retourne (issue, message d'erreur)."""
+    if not isinstance(response, dict):
+        return Outcome.UNKNOWN, "Erreur inconnue"
+    status = response.get("status")
+    if status == "success":
+        return Outcome.SUCCESS, ""
+    # Sérialisée et mise en minuscules une seule fois pour tous les tests
+    text = orjson.dumps(response).lower()
+    if "statusCode" in response:
+        if _PAST_DATE_MARK in text:
+            return Outcome.PAST_DATE, ""
+        if _UNAVAILABLE_MARK in text:
+            return Outcome.UNAVAILABLE, ""
+        return Outcome.API_ERROR, response.get("message", "Erreur inconnue")
+    if status == "error":
+        if _UNAVAILABLE_MARK in text:
+            return Outcome.UNAVAILABLE, ""
+        # "error" est un objet {"message": ...} ou parfois une simple chaîne
+        err = response.get("error")
+        if isinstance(err, dict):
+            return Outcome.API_ERROR, err.get("message", "Erreur inconnue")
+        return Outcome.API_ERROR, str(err) if err else "Erreur inconnue"
+    return Outcome.UNKNOWN, "Erreur inconnue"
+
+
+# Pour chaque issue : (action enregistrée, détail, réponse au client)
+_SCHEDULE_FR_REPLIES = {
+    Outcome.SUCCESS: (
+        "appointment_scheduled",
+        "{label} le {day} à {hour}",
+        "Parfait ! Votre rendez-vous pour {label} a été planifié avec succès le {day} à {hour} !",
+    ),
+    Outcome.PAST_DATE: (
+        "appointment_failed",
+        "Date dans le passé: {day} {hour}",
+        "La date '{day} {hour}' semble être dans le passé. Pouvez-vous me proposer une date future ? (demain, après-demain, etc.)",
+    ),
+    Outcome.UNAVAILABLE: (
+        "appointment_unavailable",
+        "Créneau non disponible: {day} {hour}",
+        "Le créneau '{day} {hour}' n'est pas disponible. Avez-vous une autre préférence ?",
+    ),
+    Outcome.API_ERROR: (
+        "appointment_error",
+        "Erreur: {error}",
+        "Erreur lors de la planification : {error}",
+    ),
+    Outcome.UNKNOWN: (
+        "appointment_failed",
+        "Erreur inconnue lors de la planification",
+        "Erreur lors de la planification. Essayons un autre créneau ?",
+    ),
+}
+
+_SCHEDULE_REPLIES = {
+    Outcome.SUCCESS: (
+        "appointment_scheduled",
+        "{label} à {date}",
+        "Parfait ! Votre rendez-vous pour {label} a été planifié avec succès !",
+    ),
+    Outcome.PAST_DATE: (
+        "appointment_failed",
+        "Date dans le passé",
+        "La date sélectionnée est dans le passé. Veuillez choisir une date future.",
+    ),
+    Outcome.UNAVAILABLE: (
+        "appointment_unavailable",
+        "Créneau {date} non disponible",
+        "Ce créneau n'est pas disponible. Proposez-moi un autre horaire ?",
+    ),
+    Outcome.API_ERROR: (
+        "appointment_error",
+        "Erreur: {error}",
+        "Erreur lors de la planification : {error}",
+    ),
+    Outcome.UNKNOWN: (
+        "appointment_failed",
+        "Erreur inconnue",
+        "Une erreur s'est produite. Proposez-moi un autre créneau ?",
+    ),
+}
+
+# Annulation et reprogrammation : les issues absentes utilisent UNKNOWN
+_CANCEL_REPLIES = {
+    Outcome.SUCCESS: (
+        "appointment_cancelled",
+        "RDV annulé pour {email}",
+        "C'est fait ! Votre rendez-vous a été annulé avec succès.",
+    ),
+    Outcome.UNKNOWN: (
+        "cancellation_failed",
+        "Échec annulation pour {email}",
+        "Erreur lors de l'annulation. Pouvez-vous me donner plus de détails sur votre rendez-vous ?",
+    ),
+}
+
+_RESCHEDULE_REPLIES = {
+    Outcome.SUCCESS: (
+        "appointment_rescheduled",
+        "RDV reprogrammé pour {email} à {new_time}",
+        "Parfait ! Votre rendez-vous a été reprogrammé avec succès.",
+    ),
+    Outcome.UNAVAILABLE: (
+        "reschedule_unavailable",
+        "Créneau {new_time} non disponible",
+        "Nous ne sommes pas disponibles à ce créneau. Proposez-moi un autre horaire ?",
+    ),
+    Outcome.UNKNOWN: (
+        "reschedule_failed",
+        "Échec reprogrammation pour {email}",
+        "Erreur lors de la reprogrammation. Essayons un autre créneau ?",
+    ),
+}
+
+
 class Scheduler(Agent):
     def __init__(self, *, service: str) -> None:
         super().__init__(
@@ -45,6 +330,7 @@ class Scheduler(Agent):
                             
                             GESTION DES DATES :
                             1. Utilisez convert_french_time_to_iso() pour convertir les demandes clients
+                               Pour vérifier plusieurs créneaux, utilisez check_availability_batch() en un seul appel
                             2. Demandez à QUELLE DATE et QUELLE HEURE ils souhaitent leur rendez-vous
                             3. Ne proposez jamais de dates vous-même - laissez le client choisir
                             4. Confirmez toujours les détails avec le client
@@ -75,10 +361,30 @@ class Scheduler(Agent):
             ],
         )
         self._service_requested = service
+        self._http: aiohttp.ClientSession | None = None
+        # Détails participant déjà construits, par (nom, email)
+        self._attendee_cache: dict[tuple[str, str], dict] = {}
 
     async def on_enter(self) -> None:
         """Prepare event IDs but stay silent until the caller speaks."""
         self._event_ids = self.session.userdata["event_ids"]
+        self._http = get_http_session(self.session.userdata)
+        # Si l'email est déjà connu, les RDV à venir sont recherchés pendant
+        # que le modèle choisit son outil (annulation / reprogrammation)
+        # (la recherche ne fait que remplir le cache partagé par email)
+        userdata = self.session.userdata
+        email = userdata["userinfo"].email
+        if (
+            email
+            and not self._cached_appointments(userdata, email)
+            and self._pending_prefetch(userdata, email) is None
+        ):
+            generation = userdata.setdefault("appts_generation", {}).get(email, 0)
+            task = asyncio.create_task(self._prefetch_appointments(self.session, email))
+            # Recherche en cours, attendue par get_appointments plutôt que refaite
+            userdata.setdefault("appts_prefetch", {})[email] = (generation, task)
+            _prefetch_tasks.add(task)
+            task.add_done_callback(_prefetch_tasks.discard)
         # Nova Sonic ne permet pas de générer une réponse vocale tant que le
         # client n'a pas parlé. Le planificateur attend donc l'entrée
         # utilisateur avant de formuler sa première réponse.
@@ -92,89 +398,96 @@ class Scheduler(Agent):
         slug: str = "",
         context: RunContext,
     ) -> dict:
-        headers = {
-            "cal-api-version": "2024-08-13",
-            "Authorization": "Bearer " + os.getenv("CAL_API_KEY"),
-        }
-        async with aiohttp.ClientSession() as session:
-            params = {}
-            
-            if request.value == "get_appts":
-                payload = {
-                    "attendeeEmail": context.userdata["userinfo"].email,
-                    "attendeeName": context.userdata["userinfo"].name,
-                    "status": "upcoming",
-                }
-                params = {
-                    "url": "https://api.cal.com/v2/bookings",
-                    "params": payload,
-                    "headers": headers,
-                }
-
-            elif request.value == "get_availability":
-                params = {
-                    "url": f"https://api.cal.com/v2/slots/available",
-                    "params": {
-                        "eventTypeId": self._event_ids[slug],
-                        "startTime": time,
-                        "endTime": time,
-                    },
-                    "headers": headers,
-                }
-
-            elif request.value == "cancel":
-                payload = {"cancellationReason": "Annulation demandée par le client"}
-                params = {
-                    "url": f"https://api.cal.com/v2/bookings/{uid}/cancel",
-                    "json": payload,
-                    "headers": headers,
-                }
-
-            elif request.value == "schedule":
-                attendee_details = {
-                    "name": context.userdata["userinfo"].name,
-                    "email": context.userdata["userinfo"].email,
-                    "timeZone": "Europe/Paris",
-                }
-                
-                if slug not in self._event_ids:
-                    raise Exception(f"Event type '{slug}' not found. Available: {list(self._event_ids.keys())}")
-                
-                payload = {
-                    "start": time,
-                    "eventTypeId": self._event_ids[slug],
-                    "attendee": attendee_details,
-                }
-
-                params = {
-                    "url": "https://api.cal.com/v2/bookings",
-                    "json": payload,
-                    "headers": headers,
-                }
-
-            elif request.value == "reschedule":
-                payload = {"start": time}
-                params = {
-                    "url": f"https://api.cal.com/v2/bookings/{uid}/reschedule",
-                    "headers": headers,
-                    "json": payload,
-                }
+        builder = _BUILDERS.get(request)
+        if builder is None:
+            raise Exception(f"Requête API non valide: {request}, {request.value}")
+        verb, url, kwargs = builder(self, uid, time, slug, context)
+        method = getattr(self._http, verb)
 
-            else:
-                raise Exception(f"Requête API non valide: {request}, {request.value}")
-            
-            # Exécuter la requête
-            if request.value in ["schedule", "reschedule", "cancel"]:
-                async with session.post(**params) as response:
-                    data = await response.json()
-                    print(f"DEBUG {request.value}: {data}")
-            elif request.value in ["get_appts", "get_availability"]:
-                async with session.get(**params) as response:
-                    data = await response.json()
-                    print(f"DEBUG {request.value}: {data}")
-            else:
-                raise Exception("Erreur de communication avec l'API Cal.com")
-            return data
+        for attempt in range(CAL_MAX_RETRIES + 1):
+            await _CAL_BUCKET.acquire()
+            async with method(url, **kwargs) as response:
+                if response.status == 429 and attempt < CAL_MAX_RETRIES:
+                    delay = _retry_after(response.headers.get("Retry-After"), attempt)
+                    logger.debug("%s: 429, nouvel essai dans %.1fs", request.value, delay)
+                else:
+                    data = await response.json(loads=orjson.loads)
+                    logger.debug("%s: %s", request.value, data)
+                    return data
+            await asyncio.sleep(delay)
+
+    async def get_appointments(self, context: RunContext) -> dict:
+        """Recherche les RDV à venir du client, avec un cache court par email
+        (les réponses vides sont aussi mises en cache)."""
+        email = context.userdata["userinfo"].email
+        cached = self._cached_appointments(context.userdata, email)
+        if cached is not None:
+            return cached
+        # Une recherche anticipée encore valide est en cours : l'attendre
+        # (shield : l'annulation de l'outil ne l'interrompt pas pour les autres)
+        pending = self._pending_prefetch(context.userdata, email)
+        if pending is not None:
+            response = await asyncio.shield(pending)
+            if response is not None:
+                return response
+        response = await self.send_request(request=APIRequests.GET_APPTS, context=context)
+        context.userdata.setdefault("appts_cache", {})[email] = (monotonic(), response)
+        return response
+
+    @staticmethod
+    def _cached_appointments(userdata: dict, email: str) -> dict | None:
+        cached = userdata.setdefault("appts_cache", {}).get(email)
+        if cached and monotonic() - cached[0] < APPTS_CACHE_TTL:
+            return cached[1]
+        return None
+
+    @staticmethod
+    def _pending_prefetch(userdata: dict, email: str) -> asyncio.Task | None:
+        """Recherche anticipée en cours pour cet email, si aucun RDV n'a été
+        modifié depuis son lancement."""
+        pending = userdata.setdefault("appts_prefetch", {}).get(email)
+        if pending is None:
+            return None
+        generation, task = pending
+        if task.done() or generation != userdata.setdefault("appts_generation", {}).get(email, 0):
+            return None
+        return task
+
+    async def _prefetch_appointments(self, session, email: str) -> dict | None:
+        # Un échec ici n'est pas bloquant : l'outil refera la requête
+        userdata = session.userdata
+        generation = userdata.setdefault("appts_generation", {}).get(email, 0)
+        try:
+            response = await self.send_request(request=APIRequests.GET_APPTS, context=session)
+        except Exception as e:
+            logger.error("Error prefetching appointments: %s", e)
+            return None
+        finally:
+            prefetches = userdata.setdefault("appts_prefetch", {})
+            if prefetches.get(email, (None, None))[1] is asyncio.current_task():
+                del prefetches[email]
+        # Un RDV modifié pendant la recherche rend la réponse obsolète
+        if userdata["appts_generation"].get(email, 0) != generation:
+            return None
+        userdata.setdefault("appts_cache", {})[email] = (monotonic(), response)
+        return response
+
+    def invalidate_appointments(self, context: RunContext) -> None:
+        """Oublie les RDV en cache du client après une modification
+        (pour tous les planificateurs, le cache étant partagé)."""
+        email = context.userdata["userinfo"].email
+        context.userdata.setdefault("appts_cache", {}).pop(email, None)
+        generations = context.userdata.setdefault("appts_generation", {})
+        generations[email] = generations.get(email, 0) + 1
+
+    def _reply(self, replies: dict, response, context: RunContext, **fields) -> str:
+        """Enregistre l'issue d'une réponse Cal.com et retourne la réponse au client."""
+        outcome, fields["error"] = _classify(response)
+        if outcome is Outcome.SUCCESS:
+            self.invalidate_appointments(context)
+        action, details, reply = replies.get(outcome) or replies[Outcome.UNKNOWN]
+        _record_action(context.userdata["session_history"], "scheduler", action, details.format(**fields))
+        return reply.format(**fields)
 
     @function_tool()
     async def check_availability(
@@ -204,14 +517,54 @@ class Scheduler(Agent):
             )
             
             if response.get("status") == "success" and response.get("data"):
-                return f"Le créneau {date} est disponible pour {service_type.replace('-', ' ')}."
+                return f"Le créneau {date} est disponible pour {SERVICE_LABELS.get(service_type, service_type)}."
             else:
-                return f"Le créneau {date} n'est pas disponible. Proposez-moi un autre horaire : demain 8h, 10h, 14h, ou 16h ?"
+                return f"Le créneau {date} n'est pas disponible. Vérifiez ensemble plusieurs alternatives avec check_availability_batch (ex: demain 8h, 10h, 14h et 16h)."
                 
         except Exception as e:
-            print(f"ERROR checking availability: {e}")
+            logger.error("Error checking availability: %s", e)
             return "Je vais vérifier les créneaux disponibles. Préférez-vous plutôt demain matin (8h-12h) ou après-midi (14h-18h) ?"
 
+    @function_tool()
+    async def check_availability_batch(
+        self,
+        service_type: Annotated[
+            str,
+            Field(
+                description="""Type de service :
+                'diagnostic-piscine', 'entretien-piscine', 'reparation-piscine', ou 'installation-equipement'"""
+            ),
+        ],
+        dates: Annotated[
+            list[str],
+            Field(description="Liste des créneaux à vérifier, au format ISO 8601 UTC")
+        ],
+        context: RunContext,
+    ) -> dict:
+        """
+        Vérifie plusieurs créneaux en une seule fois. Retourne {créneau: disponible}.
+        """
+        results = await asyncio.gather(
+            *(
+                self.send_request(
+                    request=APIRequests.GET_AVAILABILITY,
+                    time=d,
+                    slug=service_type,
+                    context=context,
+                )
+                for d in dates
+            ),
+            return_exceptions=True,
+        )
+        availability = {}
+        for d, response in zip(dates, results):
+            if isinstance(response, Exception):
+                logger.error("Error checking availability for %s: %s", d, response)
+                availability[d] = False
+            else:
+                availability[d] = bool(response.get("status") == "success" and response.get("data"))
+        return availability
+
     @function_tool()
     async def schedule_with_french_time(
         self,
@@ -230,6 +583,9 @@ class Scheduler(Agent):
         Planifie un rendez-vous en utilisant des expressions françaises de date et heure.
         Convertit automatiquement vers le format Cal.com et ENREGISTRE l'action.
         """
+        if service_type not in self._event_ids:
+            return f"Service '{service_type}' non configuré. Services disponibles : diagnostic, entretien, réparation, installation."
+
         # Vérifier que nous avons les informations client nécessaires
         userinfo = context.userdata["userinfo"]
         if not userinfo.name:
@@ -239,12 +595,12 @@ class Scheduler(Agent):
         if not userinfo.email:
             email = f"{userinfo.name.lower().replace(' ', '.')}@client-piscinik.com"
             userinfo.email = email
-            print(f"DEBUG: Email généré automatiquement: {email}")
+            logger.debug("Email généré automatiquement: %s", email)
         
         try:
             # Convertir la date/heure française vers ISO 8601 UTC
             conversion_result = await convert_french_time_to_iso(date_description, time_description)
-            print(f"DEBUG: Conversion date: {conversion_result['message']}")
+            logger.debug("Conversion date: %s", conversion_result["message"])
 
             # Extraire le format ISO de la conversion
             iso_datetime = conversion_result["iso"]
@@ -257,86 +613,19 @@ class Scheduler(Agent):
                 context=context
             )
             
-            print(f"DEBUG Schedule response: {response}")
-            
-            # Vérifier les erreurs de date passée
-            if isinstance(response, dict) and "statusCode" in response:
-                if "Attempting to book a meeting in the past" in str(response):
-                    # Enregistrer l'échec
-                    await log_action(
-                        "scheduler", 
-                        "appointment_failed", 
-                        f"Date dans le passé: {date_description} {time_description}", 
-                        context
-                    )
-                    return f"La date '{date_description} {time_description}' semble être dans le passé. Pouvez-vous me proposer une date future ? (demain, après-demain, etc.)"
-                elif "not available" in str(response).lower():
-                    # Enregistrer l'indisponibilité
-                    await log_action(
-                        "scheduler", 
-                        "appointment_unavailable", 
-                        f"Créneau non disponible: {date_description} {time_description}", 
-                        context
-                    )
-                    return f"Le créneau '{date_description} {time_description}' n'est pas disponible. Avez-vous une autre préférence ?"
-                else:
-                    await log_action(
-                        "scheduler", 
-                        "appointment_error", 
-                        f"Erreur API: {response.get('message', 'Erreur inconnue')}", 
-                        context
-                    )
-                    return f"Erreur de planification : {response.get('message', 'Erreur inconnue')}"
-            
-            # Vérifier le succès
-            if isinstance(response, dict) and "status" in response:
-                if response["status"] == "success":
-                    # ENREGISTRER LE SUCCÈS
-                    appointment_details = f"{service_type.replace('-', ' ')} le {date_description} à {time_description}"
-                    await log_action(
-                        "scheduler", 
-                        "appointment_scheduled", 
-                        appointment_details, 
-                        context
-                    )
-                    return f"Parfait ! Votre rendez-vous pour {service_type.replace('-', ' ')} a été planifié avec succès le {date_description} à {time_description} !"
-                elif response["status"] == "error":
-                    error_msg = response.get('error', {}).get('message', 'Erreur inconnue')
-                    if "not available" in error_msg.lower():
-                        await log_action(
-                            "scheduler", 
-                            "appointment_unavailable", 
-                            f"Créneau non disponible: {date_description} {time_description}", 
-                            context
-                        )
-                        return f"Le créneau '{date_description} {time_description}' n'est pas disponible. Proposez-moi un autre horaire ?"
-                    else:
-                        await log_action(
-                            "scheduler", 
-                            "appointment_error", 
-                            f"Erreur: {error_msg}", 
-                            context
-                        )
-                        return f"Erreur lors de la planification : {error_msg}"
-            
-            await log_action(
-                "scheduler", 
-                "appointment_failed", 
-                "Erreur inconnue lors de la planification", 
-                context
+            logger.debug("Schedule response: %s", response)
+            return self._reply(
+                _SCHEDULE_FR_REPLIES,
+                response,
+                context,
+                label=SERVICE_LABELS.get(service_type, service_type),
+                day=date_description,
+                hour=time_description,
             )
-            return f"Erreur lors de la planification. Essayons un autre créneau ?"
             
         except Exception as e:
-            print(f"ERROR in schedule_with_french_time: {e}")
-            await log_action(
-                "scheduler", 
-                "appointment_error", 
-                f"Exception: {str(e)}", 
-                context
-            )
-            if "not found" in str(e):
-                return f"Service '{service_type}' non configuré. Services disponibles : diagnostic, entretien, réparation, installation."
+            logger.error("Error in schedule_with_french_time: %s", e)
+            _record_action(context.userdata["session_history"], "scheduler", "appointment_error", f"Exception: {str(e)}")
             return f"Erreur technique lors de la planification. Pouvez-vous me reproposer une date et heure ?"
 
     @function_tool()
@@ -363,6 +652,9 @@ class Scheduler(Agent):
         Planifie un nouveau rendez-vous (version directe avec ISO 8601).
         Préférez schedule_with_french_time() pour les demandes en français.
         """
+        if service_type not in self._event_ids:
+            return f"Service '{service_type}' non configuré. Services disponibles : diagnostic, entretien, réparation, installation."
+
         context.userdata["userinfo"].name = name
         
         if not context.userdata["userinfo"].email:
@@ -374,46 +666,18 @@ class Scheduler(Agent):
                 request=APIRequests.SCHEDULE, time=date, slug=service_type, context=context
             )
             
-            print(f"DEBUG Schedule response: {response}")
-            
-            if isinstance(response, dict) and "statusCode" in response:
-                if "Attempting to book a meeting in the past" in str(response):
-                    await log_action("scheduler", "appointment_failed", "Date dans le passé", context)
-                    return "La date sélectionnée est dans le passé. Veuillez choisir une date future."
-                elif "not available" in str(response).lower():
-                    await log_action("scheduler", "appointment_unavailable", f"Créneau {date} non disponible", context)
-                    return "Ce créneau n'est pas disponible. Proposez-moi un autre horaire ?"
-                else:
-                    await log_action("scheduler", "appointment_error", f"Erreur: {response.get('message', 'Inconnue')}", context)
-                    return f"Impossible de planifier : {response.get('message', 'Erreur inconnue')}"
-            
-            if isinstance(response, dict) and "status" in response:
-                if response["status"] == "success":
-                    # ENREGISTRER LE SUCCÈS
-                    await log_action(
-                        "scheduler", 
-                        "appointment_scheduled", 
-                        f"{service_type.replace('-', ' ')} à {date}", 
-                        context
-                    )
-                    return f"Parfait ! Votre rendez-vous pour {service_type.replace('-', ' ')} a été planifié avec succès !"
-                elif response["status"] == "error":
-                    error_msg = response.get('error', {}).get('message', 'Erreur inconnue')
-                    if "not available" in error_msg.lower():
-                        await log_action("scheduler", "appointment_unavailable", f"Créneau {date} non disponible", context)
-                        return "Ce créneau n'est pas disponible. Avez-vous une autre préférence ?"
-                    else:
-                        await log_action("scheduler", "appointment_error", f"Erreur: {error_msg}", context)
-                        return f"Erreur lors de la planification : {error_msg}"
-            
-            await log_action("scheduler", "appointment_failed", "Erreur inconnue", context)
-            return "Une erreur s'est produite. Proposez-moi un autre créneau ?"
+            logger.debug("Schedule response: %s", response)
+            return self._reply(
+                _SCHEDULE_REPLIES,
+                response,
+                context,
+                label=SERVICE_LABELS.get(service_type, service_type),
+                date=date,
+            )
             
         except Exception as e:
-            print(f"ERROR in schedule: {e}")
-            await log_action("scheduler", "appointment_error", f"Exception: {str(e)}", context)
-            if "not found" in str(e):
-                return f"Service '{service_type}' non configuré. Services disponibles : diagnostic, entretien, réparation, installation."
+            logger.error("Error in schedule: %s", e)
+            _record_action(context.userdata["session_history"], "scheduler", "appointment_error", f"Exception: {str(e)}")
             return "Erreur technique. Essayons un autre créneau ?"
 
     @function_tool()
@@ -429,29 +693,18 @@ class Scheduler(Agent):
         """
         context.userdata["userinfo"].email = email
         try:
-            response = await self.send_request(request=APIRequests.GET_APPTS, context=context)
+            response = await self.get_appointments(context)
             if response.get("data"):
                 cancel_response = await self.send_request(
                     request=APIRequests.CANCEL, uid=response["data"][0]["uid"], context=context
                 )
-                if cancel_response.get("status") == "success":
-                    # ENREGISTRER L'ANNULATION
-                    await log_action(
-                        "scheduler", 
-                        "appointment_cancelled", 
-                        f"RDV annulé pour {email}", 
-                        context
-                    )
-                    return "C'est fait ! Votre rendez-vous a été annulé avec succès."
-                else:
-                    await log_action("scheduler", "cancellation_failed", f"Échec annulation pour {email}", context)
-                    return "Erreur lors de l'annulation. Pouvez-vous me donner plus de détails sur votre rendez-vous ?"
+                return self._reply(_CANCEL_REPLIES, cancel_response, context, email=email)
             else:
-                await log_action("scheduler", "cancellation_failed", f"Aucun RDV trouvé pour {email}", context)
+                _record_action(context.userdata["session_history"], "scheduler", "cancellation_failed", f"Aucun RDV trouvé pour {email}")
                 return "Je ne trouve pas de rendez-vous à votre nom. Souhaitez-vous plutôt en planifier un ?"
         except Exception as e:
-            print(f"ERROR in cancel: {e}")
-            await log_action("scheduler", "cancellation_error", f"Exception: {str(e)}", context)
+            logger.error("Error in cancel: %s", e)
+            _record_action(context.userdata["session_history"], "scheduler", "cancellation_error", f"Exception: {str(e)}")
             return "Erreur lors de la recherche de votre rendez-vous. Vérifiez votre email ou contactez-nous directement."
 
     @function_tool()
@@ -471,7 +724,7 @@ class Scheduler(Agent):
         """
         context.userdata["userinfo"].email = email
         try:
-            response = await self.send_request(request=APIRequests.GET_APPTS, context=context)
+            response = await self.get_appointments(context)
             if response.get("data"):
                 reschedule_response = await self.send_request(
                     request=APIRequests.RESCHEDULE,
@@ -479,25 +732,13 @@ class Scheduler(Agent):
                     time=new_time,
                     context=context,
                 )
-                if reschedule_response.get("status") == "success":
-                    # ENREGISTRER LA REPROGRAMMATION
-                    await log_action(
-                        "scheduler", 
-                        "appointment_rescheduled", 
-                        f"RDV reprogrammé pour {email} à {new_time}", 
-                        context
-                    )
-                    return "Parfait ! Votre rendez-vous a été reprogrammé avec succès."
-                elif "not available" in str(reschedule_response).lower():
-                    await log_action("scheduler", "reschedule_unavailable", f"Créneau {new_time} non disponible", context)
-                    return "Nous ne sommes pas disponibles à ce créneau. Proposez-moi un autre horaire ?"
-                else:
-                    await log_action("scheduler", "reschedule_failed", f"Échec reprogrammation pour {email}", context)
-                    return "Erreur lors de la reprogrammation. Essayons un autre créneau ?"
+                return self._reply(
+                    _RESCHEDULE_REPLIES, reschedule_response, context, email=email, new_time=new_time
+                )
             else:
-                await log_action("scheduler", "reschedule_failed", f"Aucun RDV trouvé pour {email}", context)
+                _record_action(context.userdata["session_history"], "scheduler", "reschedule_failed", f"Aucun RDV trouvé pour {email}")
                 return "Je ne trouve pas de rendez-vous à votre nom. Souhaitez-vous plutôt en planifier un ?"
         except Exception as e:
-            print(f"ERROR in reschedule: {e}")
-            await log_action("scheduler", "reschedule_error", f"Exception: {str(e)}", context)
+            logger.error("Error in reschedule: %s", e)
+            _record_action(context.userdata["session_history"], "scheduler", "reschedule_error", f"Exception: {str(e)}")
             return "Erreur lors de la reprogrammation. Pouvez-vous me proposer un autre créneau ?"
\ No newline at end of file
@@ -1,5 +1,7 @@
 # tasks/technical_expert_task.py - Avec RAG intégré
-from typing import Annotated
+import asyncio
+import logging
+from typing import Annotated, Literal
 from pydantic import Field
 from livekit.agents.llm import function_tool
 from livekit.agents import Agent, RunContext
@@ -15,6 +17,26 @@ from .global_functions import (
 # Import du système RAG (import absolu)
 from rag_system import get_rag_system
 
+logger = logging.getLogger(__name__)
+
+# Préfixe ajouté à la question selon la catégorie choisie par le modèle
+_CATEGORY_PREFIXES = {
+    "chemistry": "Problème chimique eau piscine: ",
+    "equipment": "Problème équipement: ",
+    "maintenance": "Planning entretien piscine: ",
+    "seasonal": "Entretien piscine saison: ",
+    "emergency": "Urgence piscine: ",
+}
+
+_SAFETY_ADVICE = """
+        
+        SÉCURITÉ IMMÉDIATE :
+        1. Interdire la baignade si risque
+        2. Couper l'alimentation électrique si nécessaire
+        3. Photographier le problème
+        
+        Souhaitez-vous planifier une intervention d'urgence ?"""
+
 class TechnicalExpert(Agent):
     def __init__(self) -> None:
         super().__init__(
@@ -28,6 +50,10 @@ class TechnicalExpert(Agent):
             - Conseils d'entretien ou de maintenance
             - Toute question technique sur les piscines
             
+            Précisez la catégorie quand elle est évidente : chemistry (chimie de l'eau),
+            equipment (panne d'équipement), maintenance (planning d'entretien),
+            seasonal (saison), emergency (urgence ou danger - ajoute les consignes de sécurité).
+            
             Utilisez TOUJOURS technical_advice_rag avant de répondre à une question technique.""",
             tools=[
                 update_information,
@@ -38,121 +64,76 @@ class TechnicalExpert(Agent):
                 get_date_today,
             ],
         )
+        # Instance RAG résolue au premier appel (ou dès on_enter) puis réutilisée
+        self._rag = None
+        self._warm_task: asyncio.Task | None = None
 
     async def on_enter(self) -> None:
         # L'expert technique reste silencieux jusqu'à ce que le client pose
         # sa question afin d'éviter toute génération non sollicitée.
-        pass
+        # On en profite pour préparer le RAG en arrière-plan.
+        if self._rag is None and self._warm_task is None:
+            self._warm_task = asyncio.create_task(self._warm_rag())
+
+    async def _warm_rag(self) -> None:
+        try:
+            self._rag = await get_rag_system()
+            await self._rag.warm()
+        except Exception as e:
+            logger.error("❌ ERREUR préchauffage RAG: %s", e)
 
     @function_tool()
     async def technical_advice_rag(
         self,
         question: Annotated[str, Field(description="N'IMPORTE QUELLE question technique du client sur sa piscine - utilisez cette fonction pour TOUTE question")],
         context: RunContext,
+        category: Annotated[
+            Literal["chemistry", "equipment", "maintenance", "seasonal", "emergency"] | None,
+            Field(description="Catégorie de la question si elle est évidente (emergency pour une urgence)"),
+        ] = None,
     ) -> str:
         """
         FONCTION PRINCIPALE : Fournit des conseils techniques pour TOUTE question sur les piscines.
         Utilisez cette fonction pour TOUS les problèmes : eau verte, pH, équipements, entretien, etc.
         """
+        # Pour les urgences, les consignes de sécurité accompagnent toute réponse,
+        # y compris quand la base de connaissances est indisponible
+        safety = _SAFETY_ADVICE if category == "emergency" else ""
         try:
-            # Obtenir l'instance RAG
-            rag = await get_rag_system()
+            # Obtenir l'instance RAG (une seule fois par agent)
+            if self._rag is None:
+                self._rag = await get_rag_system()
+            rag = self._rag
             
             # Enrichir la question avec le contexte client
+            pool_type = context.userdata["userinfo"].pool_type
+            pool_size = context.userdata["userinfo"].pool_size
+            if category == "maintenance":
+                # Le planning d'entretien dépend de la piscine : valeurs par défaut si inconnue
+                pool_type = pool_type or "standard"
+                pool_size = pool_size or "moyenne"
             pool_info = ""
-            if context.userdata["userinfo"].pool_type:
-                pool_info += f" Type de piscine: {context.userdata['userinfo'].pool_type}."
-            if context.userdata["userinfo"].pool_size:
-                pool_info += f" Taille: {context.userdata['userinfo'].pool_size}."
+            if pool_type:
+                pool_info += f" Type de piscine: {pool_type}."
+            if pool_size:
+                pool_info += f" Taille: {pool_size}."
             
-            enriched_question = f"{question}{pool_info}"
+            enriched_question = f"{_CATEGORY_PREFIXES.get(category, '')}{question}{pool_info}"
             
-            # Obtenir la réponse RAG
+            # Obtenir la réponse RAG (la piscine du client fait partie de la
+            # clé du cache sémantique : pas de réponse servie à une autre piscine)
             answer = await rag.get_answer(enriched_question)
             
             # LOG CRUCIAL pour debug
-            print(f"🎯 RÉPONSE RAG REÇUE: {answer}")
+            logger.debug("🎯 RÉPONSE RAG REÇUE: %s", answer)
             
             # Vérifier que la réponse n'est pas vide
             if not answer or answer.strip() == "":
-                return "Je rencontre un problème technique avec ma base de connaissances. Laissez-moi vous aider autrement."
+                return "Je rencontre un problème technique avec ma base de connaissances. Laissez-moi vous aider autrement." + safety
             
-            return answer
+            # Pour les urgences, on combine RAG + conseils sécurité
+            return answer + safety
             
         except Exception as e:
-            print(f"❌ ERREUR technical_advice_rag: {e}")
-            return f"Je rencontre un problème technique pour accéder à ma base de connaissances. Pouvez-vous reformuler votre question ? Si le problème est urgent, je peux vous transférer pour planifier une intervention."
-
-    @function_tool()
-    async def water_chemistry_advice(
-        self,
-        issue: Annotated[str, Field(description="Le problème chimique de l'eau décrit par le client")],
-        context: RunContext,
-    ) -> str:
-        """
-        Fournit des conseils sur l'équilibrage chimique de l'eau de piscine.
-        """
-        # Utiliser le RAG pour les conseils chimiques
-        return await self.technical_advice_rag(f"Problème chimique eau piscine: {issue}", context)
-
-    @function_tool()
-    async def equipment_troubleshooting(
-        self,
-        equipment: Annotated[str, Field(description="L'équipement concerné par le problème")],
-        problem: Annotated[str, Field(description="Description du problème rencontré")],
-        context: RunContext,
-    ) -> str:
-        """
-        Aide au diagnostic et dépannage des équipements de piscine.
-        """
-        # Utiliser le RAG pour le dépannage équipement
-        return await self.technical_advice_rag(f"Problème équipement {equipment}: {problem}", context)
-
-    @function_tool()
-    async def maintenance_schedule_advice(
-        self,
-        context: RunContext,
-    ) -> str:
-        """
-        Fournit un planning d'entretien personnalisé selon le type de piscine.
-        """
-        pool_type = context.userdata["userinfo"].pool_type or "standard"
-        pool_size = context.userdata["userinfo"].pool_size or "moyenne"
-        
-        # Utiliser le RAG pour les conseils d'entretien
-        return await self.technical_advice_rag(f"Planning entretien piscine {pool_type} {pool_size}", context)
-
-    @function_tool()
-    async def seasonal_advice(
-        self,
-        season: Annotated[str, Field(description="La saison concernée : printemps, été, automne, hiver")],
-        context: RunContext,
-    ) -> str:
-        """
-        Conseils d'entretien saisonnier pour la piscine.
-        """
-        # Utiliser le RAG pour les conseils saisonniers
-        return await self.technical_advice_rag(f"Entretien piscine saison {season}", context)
-
-    @function_tool()
-    async def emergency_advice(
-        self,
-        emergency: Annotated[str, Field(description="Description de l'urgence ou problème grave")],
-        context: RunContext,
-    ) -> str:
-        """
-        Conseils d'urgence pour problèmes graves de piscine.
-        """
-        # Pour les urgences, on combine RAG + conseils sécurité
-        rag_advice = await self.technical_advice_rag(f"Urgence piscine: {emergency}", context)
-        
-        safety_advice = """
-        
-        SÉCURITÉ IMMÉDIATE :
-        1. Interdire la baignade si risque
-        2. Couper l'alimentation électrique si nécessaire
-        3. Photographier le problème
-        
-        Souhaitez-vous planifier une intervention d'urgence ?"""
-        
-        return rag_advice + safety_advice
\ No newline at end of file
+            logger.error("❌ ERREUR technical_advice_rag: %s", e)
+            return f"Je rencontre un problème technique pour accéder à ma base de connaissances. Pouvez-vous reformuler votre question ? Si le problème est urgent, je peux vous transférer pour planifier une intervention." + safety
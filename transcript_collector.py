@@ -1,9 +1,12 @@
 # transcript_collector.py - Enhanced with real-time webhooks
 import aiohttp
-import json
+import orjson
 import os
 import logging
 import asyncio
+import gzip
+import re
+import time
 from datetime import datetime, timezone
 from livekit.agents import ConversationItemAddedEvent
 
@@ -11,22 +14,107 @@ from livekit.agents import ConversationItemAddedEvent
 WEBHOOK_URL = os.getenv("TRANSCRIPTION_WEBHOOK_URL")  # Supabase (session end)
 MAKE_WEBHOOK_URL = os.getenv("MAKE_WEBHOOK_URL")      # Make.com (real-time)
 VOICEBOT_ID_ENV = os.getenv("VOICEBOT_ID")
+# The end-of-call export is not latency-bound; allow more than the real-time 5s
+EXPORT_TIMEOUT = aiohttp.ClientTimeout(total=30)
+# Pending real-time webhooks kept in memory, and how long the export waits for them
+WEBHOOK_QUEUE_SIZE = 256
+WEBHOOK_DRAIN_TIMEOUT = 5
+# Messages queued within this window (seconds) are posted together
+WEBHOOK_BATCH_WINDOW = 0.25
+WEBHOOK_MAX_BATCH = 50
+# Retries on 5xx/network errors: quick for real-time, more patient for the export
+WEBHOOK_ATTEMPTS, WEBHOOK_BACKOFF = 3, 0.2
+EXPORT_ATTEMPTS, EXPORT_BACKOFF = 5, 1.0
+# Upload the Supabase transcript in chunks of this many messages during the call
+# (0 = single export at the end). Needs an RPC accepting p_transcription_delta.
+TRANSCRIPT_FLUSH_EVERY = int(os.getenv("TRANSCRIPT_FLUSH_EVERY", "0"))
+# Gzip the Supabase transcript uploads (the endpoint must accept Content-Encoding: gzip)
+GZIP_SUPABASE = os.getenv("TRANSCRIPT_GZIP") == "1"
 log = logging.getLogger(__name__)
 
+# International number embedded in a room name
+_PHONE_RE = re.compile(r'\+\d{10,15}')
+
+def _short(text: str, limit: int = 200) -> str:
+    """Truncates a message for the console; webhooks and export keep the full text"""
+    return text if len(text) <= limit else f"{text[:limit]}…(+{len(text) - limit})"
+
+
+def _supabase_headers() -> dict:
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    if GZIP_SUPABASE:
+        headers["Content-Encoding"] = "gzip"
+    return headers
+
+
+async def _supabase_body(payload: dict) -> bytes:
+    """Serializes a Supabase payload, gzipped off the event loop when enabled"""
+    body = orjson.dumps(payload)
+    if GZIP_SUPABASE:
+        body = await asyncio.get_running_loop().run_in_executor(None, gzip.compress, body)
+    return body
+
+
 class TranscriptCollector:
+    # Lives for the whole call: fixed attribute layout, no per-instance __dict__
+    __slots__ = (
+        "_session",
+        "_job_ctx",
+        "_userdata",
+        "_messages",
+        "_started",
+        "_started_monotonic",
+        "_chunks_sent",
+        "_flushed",
+        "_chunk_end",
+        "_flush_task",
+        "_http",
+        "_room_name",
+        "_phone_number",
+        "_static_payload_base",
+        "_wh_queue",
+        "_wh_worker_task",
+    )
+
     def __init__(self, session, job_ctx, userdata: dict):
         self._session = session
         self._job_ctx = job_ctx
         self._userdata = userdata
         self._messages = []
         self._started = datetime.now(timezone.utc)
+        self._started_monotonic = time.monotonic()  # For the duration, immune to clock changes
+        # Chunked Supabase upload: chunks confirmed, messages they cover, end of
+        # the chunk being (re)tried, and the upload in progress (one at a time)
+        self._chunks_sent = 0
+        self._flushed = 0
+        self._chunk_end: int | None = None
+        self._flush_task: asyncio.Task | None = None
+        # Shared HTTP session for all webhook posts (created on first use)
+        self._http: aiohttp.ClientSession | None = None
 
-        # Store room and participant info for phone extraction
+        # Store room info for phone extraction
         self._room_name = getattr(job_ctx.room, 'name', '') if hasattr(job_ctx, 'room') else ''
-        self._participants = []
+        # Caller number found in the room/participants, resolved once
+        self._phone_number: str | None = None
+
+        # Real-time payload fields that never change during the call
+        self._static_payload_base = {
+            "event_type": "conversation_message",
+            "voicebot_id": VOICEBOT_ID_ENV,
+            "session_started": self._started.isoformat(),
+        }
+
+        # Real-time webhooks are posted by a background worker so the
+        # conversation listener never waits on Make.com
+        self._wh_queue: asyncio.Queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self._wh_worker_task = asyncio.create_task(self._wh_worker()) if MAKE_WEBHOOK_URL else None
 
         # Real-time listener for each chat item
-        session.on("conversation_item_added", self._on_msg_sync)
+        session.on("conversation_item_added", self._on_msg)
+        # Resolve the caller number as soon as the SIP participant joins
+        if hasattr(job_ctx, 'room'):
+            job_ctx.room.on("participant_connected", self._on_participant_connected)
         # One-shot export when the session shuts down
         job_ctx.add_shutdown_callback(self._export)
         
@@ -36,78 +124,202 @@ class TranscriptCollector:
         if WEBHOOK_URL:
             print(f"📊 Session webhook: {WEBHOOK_URL[:50]}...")
 
-    def _on_msg_sync(self, evt: ConversationItemAddedEvent):
-        # Schedule the async handler without blocking
-        asyncio.create_task(self._on_msg(evt))
-
-    async def _on_msg(self, evt: ConversationItemAddedEvent):
+    def _on_msg(self, evt: ConversationItemAddedEvent):
         # Determine who spoke
         role = getattr(evt.item, "role", "unknown")
         # Extract text (use text_content helper if available)
-        text = getattr(evt.item, "text_content", "") or ""
+        text = getattr(evt.item, "text_content", None)
         if not text:
             raw = evt.item.content
             if isinstance(raw, list):
-                text = " ".join(str(c) for c in raw if isinstance(c, str))
+                try:
+                    text = " ".join(raw)  # Common case: text-only content
+                except TypeError:
+                    # Mixed content (audio/image parts): keep only the strings
+                    text = " ".join([c for c in raw if isinstance(c, str)])
             else:
-                text = str(raw or "")
+                text = "" if raw is None else str(raw)
+        
+        # Tool calls, empty deltas and markers carry no visible text: nothing to log or send
+        if not text or text.isspace():
+            return
         
-        # Add to internal log
-        message_data = {"role": role, "text": text, "timestamp": datetime.now(timezone.utc).isoformat()}
+        # Add to internal log (one clock read per message)
+        now = datetime.now(timezone.utc)
+        message_data = {"role": role, "text": text, "timestamp": now.isoformat()}
         self._messages.append(message_data)
+        if (
+            TRANSCRIPT_FLUSH_EVERY
+            and WEBHOOK_URL
+            and len(self._messages) - self._flushed >= TRANSCRIPT_FLUSH_EVERY
+            and (self._flush_task is None or self._flush_task.done())
+        ):
+            self._flush_task = asyncio.create_task(self._upload_chunk())
         
-        # 🎯 REAL-TIME CONSOLE LOG
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        if role == "user":
-            print(f"👤 [{timestamp}] USER: {text}")
-        elif role == "assistant":
-            print(f"🤖 [{timestamp}] AGENT: {text}")
-        else:
-            print(f"💬 [{timestamp}] {role.upper()}: {text}")
+        # 🎯 REAL-TIME CONSOLE LOG (debug level, off the stdout hot path)
+        if log.isEnabledFor(logging.DEBUG):
+            timestamp = now.astimezone().strftime("%H:%M:%S")
+            if role == "user":
+                log.debug("👤 [%s] USER: %s", timestamp, _short(text))
+            elif role == "assistant":
+                log.debug("🤖 [%s] AGENT: %s", timestamp, _short(text))
+            else:
+                log.debug("💬 [%s] %s: %s", timestamp, role.upper(), _short(text))
         
         # 🎯 REAL-TIME WEBHOOK to Make.com (if configured)
-        if MAKE_WEBHOOK_URL and text.strip():
-            await self._send_realtime_webhook(role, text, message_data)
+        if MAKE_WEBHOOK_URL:
+            self._enqueue_webhook(self._realtime_payload(role, text, message_data))
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        """Returns the shared webhook session, keeping connections to Make.com/Supabase warm"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=5),  # Quick timeout for real-time
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60),
+            )
+        return self._http
+
+    def _realtime_payload(self, role: str, text: str, message_data: dict) -> dict:
+        """Simplified payload for Make.com"""
+        userinfo = self._userdata.get("userinfo")
+        return {
+            **self._static_payload_base,
+            "phone_number": self._extract_phone_number(),
+            "timestamp": message_data["timestamp"],
+            "role": role,
+            "text": text,
+            # Collected during the call, so read on every message
+            "client_info": {
+                "name": getattr(userinfo, 'name', None),
+                "email": getattr(userinfo, 'email', None),
+                "pool_type": getattr(userinfo, 'pool_type', None),
+            }
+        }
+
+    def _enqueue_webhook(self, payload: dict):
+        """Queue a real-time payload; when the queue is full the oldest one is dropped"""
+        try:
+            self._wh_queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            dropped = self._wh_queue.get_nowait()
+            self._wh_queue.task_done()
+            log.warning(f"⚠️ Webhook queue full, dropping {dropped['role']} message")
+            self._wh_queue.put_nowait(payload)
+
+    async def _wh_worker(self):
+        """Posts queued real-time payloads on the shared session, coalescing bursts"""
+        while True:
+            batch = [await self._wh_queue.get()]
+            # Let messages arriving together go out in the same POST
+            await asyncio.sleep(WEBHOOK_BATCH_WINDOW)
+            while len(batch) < WEBHOOK_MAX_BATCH and not self._wh_queue.empty():
+                batch.append(self._wh_queue.get_nowait())
+            try:
+                await self._send_realtime_webhook(self._batch_payload(batch))
+            finally:
+                for _ in batch:
+                    self._wh_queue.task_done()
 
-    async def _send_realtime_webhook(self, role: str, text: str, message_data: dict):
+    @staticmethod
+    def _batch_payload(batch: list) -> dict:
+        """Single messages keep the per-message format; bursts are sent as one list"""
+        if len(batch) == 1:
+            return batch[0]
+        latest = batch[-1]
+        return {
+            **latest,
+            "event_type": "conversation_messages",
+            "timestamp": batch[0]["timestamp"],
+            "role": "batch",
+            "text": None,
+            "messages": [
+                {"timestamp": p["timestamp"], "role": p["role"], "text": p["text"]}
+                for p in batch
+            ],
+        }
+
+    async def _drain_webhooks(self):
+        """Lets the worker send what is still queued, then stops it"""
+        if self._wh_worker_task is None:
+            return
+        try:
+            await asyncio.wait_for(self._wh_queue.join(), timeout=WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"⚠️ {self._wh_queue.qsize()} real-time webhooks not sent before export")
+        self._wh_worker_task.cancel()
+        self._wh_worker_task = None
+
+    async def _send_realtime_webhook(self, payload: dict):
         """Send individual message to Make.com webhook in real-time"""
         try:
-            phone_number = self._extract_phone_number()
-            
-            # Simplified payload for Make.com
-            payload = {
-                "event_type": "conversation_message",
-                "voicebot_id": VOICEBOT_ID_ENV,
-                "phone_number": phone_number,
-                "timestamp": message_data["timestamp"],
-                "role": role,
-                "text": text,
-                "session_started": self._started.isoformat(),
-                "client_info": {
-                    "name": getattr(self._userdata.get("userinfo", {}), 'name', None),
-                    "email": getattr(self._userdata.get("userinfo", {}), 'email', None),
-                    "pool_type": getattr(self._userdata.get("userinfo", {}), 'pool_type', None),
-                }
-            }
-            
-            # Simple headers for Make.com
-            headers = {"Content-Type": "application/json"}
-            
-            async with aiohttp.ClientSession() as http:
-                resp = await http.post(
-                    MAKE_WEBHOOK_URL,
-                    headers=headers,
-                    data=json.dumps(payload, ensure_ascii=False),
-                    timeout=5  # Quick timeout for real-time
-                )
-                if resp.status in (200, 201, 204):
-                    log.debug(f"✅ Real-time webhook sent: {role} message")
-                else:
-                    log.warning(f"⚠️ Webhook failed: {resp.status}")
+            status, _ = await self._post(
+                MAKE_WEBHOOK_URL,
+                orjson.dumps(payload),
+                attempts=WEBHOOK_ATTEMPTS,
+                backoff=WEBHOOK_BACKOFF,
+            )
+            if status in (200, 201, 204):
+                log.debug(f"✅ Real-time webhook sent: {payload['role']} message")
+            else:
+                log.warning(f"⚠️ Webhook failed: {status}")
                     
         except Exception as e:
             log.error(f"❌ Real-time webhook error: {e}")
 
+    async def _post(self, url: str, body: bytes, *, attempts: int, backoff: float, **kwargs):
+        """POST on the shared session, retrying 5xx, connection errors and timeouts
+        with exponential backoff. Returns (status, body text) of the last response."""
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                async with self._get_http().post(url, data=body, **kwargs) as resp:
+                    if resp.status < 500 or last:
+                        return resp.status, await resp.text()
+                    log.warning(f"⚠️ {url[:50]} returned {resp.status}, retrying")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if last:
+                    raise
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+    def _on_participant_connected(self, participant):
+        identity = getattr(participant, 'identity', '')
+        if self._phone_number is None and identity.startswith("sip_"):
+            self._phone_number = identity[4:]  # Remove "sip_" prefix
+            log.info(f"Extracted phone from participant identity: {self._phone_number}")
+
+    async def _upload_chunk(self):
+        """Uploads the messages since the last confirmed chunk. A failed chunk is
+        retried later with the same index and the same messages."""
+        if self._chunk_end is None:
+            self._chunk_end = len(self._messages)
+        index, delta = self._chunks_sent, self._messages[self._flushed:self._chunk_end]
+        payload = {
+            "p_voicebot_id": VOICEBOT_ID_ENV,
+            "p_phone_number": self._extract_phone_number(),
+            "p_started_at": self._started.isoformat(),
+            "p_chunk_index": index,
+            "p_transcription_delta": delta,
+            "p_service_type": "piscinik",
+        }
+        try:
+            status, err = await self._post(
+                WEBHOOK_URL,
+                await _supabase_body(payload),
+                attempts=EXPORT_ATTEMPTS,
+                backoff=EXPORT_BACKOFF,
+                headers=_supabase_headers(),
+                timeout=EXPORT_TIMEOUT,
+            )
+            if status in (200, 201, 204):
+                log.debug(f"✅ Transcript chunk {index} uploaded ({len(delta)} messages)")
+                self._flushed, self._chunk_end = self._chunk_end, None
+                self._chunks_sent += 1
+                return
+            log.error("Supabase chunk %s failed %s: %s", index, status, err)
+        except Exception:
+            log.exception("Error uploading transcript chunk %s", index)
+
     def _extract_phone_number(self):
         """Extract phone number from available sources"""
         
@@ -116,16 +328,28 @@ class TranscriptCollector:
             phone = self._userdata["userinfo"].phone
             if phone:
                 return phone
+
+        # Room and participant lookups only need to succeed once
+        if self._phone_number is None:
+            phone = self._phone_from_room()
+            if phone is None:
+                log.warning("Could not extract phone number from any source")
+                return "unknown"
+            self._phone_number = phone
+        return self._phone_number
+
+    def _phone_from_room(self):
+        """Extract phone number from the room name or its participants"""
+
+        # Method 2: From the room name, e.g. "ai-call-_+PHONE_RANDOM" or any "+digits"
+        phone_match = _PHONE_RE.search(self._room_name) if self._room_name else None
+        if phone_match:
+            phone = phone_match.group()
+            log.info(f"Extracted phone from room name: {phone}")
+            return phone
         
-        # Method 2: From room name pattern "ai-call-_+PHONE_RANDOM"
-        if self._room_name and self._room_name.startswith("ai-call-_"):
-            # Extract between "ai-call-_" and the last "_"
-            parts = self._room_name[9:].split('_')  # Remove "ai-call-_" prefix
-            if parts and parts[0].startswith('+'):
-                log.info(f"Extracted phone from room name: {parts[0]}")
-                return parts[0]
-        
-        # Method 3: From job context room participants
+        # Method 3: From job context room participants (only those already in the
+        # room at connect; later SIP participants are caught by participant_connected)
         try:
             if hasattr(self._job_ctx, 'room') and hasattr(self._job_ctx.room, 'remote_participants'):
                 for participant in self._job_ctx.room.remote_participants.values():
@@ -137,27 +361,24 @@ class TranscriptCollector:
         except Exception as e:
             log.debug(f"Could not extract from participants: {e}")
         
-        # Method 4: Check if room name contains phone in different format
-        if self._room_name:
-            # Look for phone patterns in room name
-            import re
-            phone_match = re.search(r'\+\d{10,15}', self._room_name)
-            if phone_match:
-                phone = phone_match.group()
-                log.info(f"Extracted phone from room name regex: {phone}")
-                return phone
-        
-        log.warning("Could not extract phone number from any source")
-        return "unknown"
+        return None
 
     async def _export(self, reason):
+        # Flush the real-time webhooks first so Make.com receives them in order
+        await self._drain_webhooks()
+
+        # Let an in-flight transcript chunk finish (unconfirmed messages go in the export)
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+
         # Skip if nothing to send
         if not self._messages:
             log.info("No messages to export; skipping")
+            await self._close_http()
             return
 
         ended = datetime.now(timezone.utc)
-        duration = int((ended - self._started).total_seconds())
+        duration = int(time.monotonic() - self._started_monotonic)
 
         # Debug information
         log.info(f"DEBUG userdata: {self._userdata}")
@@ -183,20 +404,22 @@ class TranscriptCollector:
             },
         }
 
-        async with aiohttp.ClientSession() as http:
+        try:
             # Send transcript to Make.com webhook if configured
             if MAKE_WEBHOOK_URL:
                 try:
                     make_payload = {"event_type": "conversation_complete", **base_payload}
-                    resp = await http.post(
+                    status, _ = await self._post(
                         MAKE_WEBHOOK_URL,
-                        headers={"Content-Type": "application/json"},
-                        data=json.dumps(make_payload, ensure_ascii=False),
+                        orjson.dumps(make_payload),
+                        attempts=EXPORT_ATTEMPTS,
+                        backoff=EXPORT_BACKOFF,
+                        timeout=EXPORT_TIMEOUT,
                     )
-                    if resp.status in (200, 201, 204):
+                    if status in (200, 201, 204):
                         log.info("✅ Successfully sent transcript to Make webhook")
                     else:
-                        log.warning("⚠️ Make webhook failed: %s", resp.status)
+                        log.warning("⚠️ Make webhook failed: %s", status)
                 except Exception:
                     log.exception("Error calling Make webhook")
 
@@ -209,26 +432,25 @@ class TranscriptCollector:
                     "p_ended_at": ended.isoformat(),
                     "p_credits_used": duration,
                     "p_duration": duration,
-                    "p_transcription": self._messages,
+                    "p_transcription": self._messages[self._flushed:],
                     "p_service_type": "piscinik",
                     "p_client_info": base_payload["client_info"],
                 }
-
-                headers = {
-                    "apikey": os.getenv("SUPABASE_SERVICE_ROLE_KEY"),
-                    "Authorization": f"Bearer {os.getenv('SUPABASE_SERVICE_ROLE_KEY')}",
-                    "Content-Type": "application/json",
-                }
+                # With chunked uploads only the unconfirmed tail is sent; tell the RPC how many came before
+                if self._chunks_sent:
+                    supabase_payload["p_chunks_sent"] = self._chunks_sent
 
                 try:
-                    resp = await http.post(
+                    status, err = await self._post(
                         WEBHOOK_URL,
-                        headers=headers,
-                        data=json.dumps(supabase_payload, ensure_ascii=False),
+                        await _supabase_body(supabase_payload),
+                        attempts=EXPORT_ATTEMPTS,
+                        backoff=EXPORT_BACKOFF,
+                        headers=_supabase_headers(),
+                        timeout=EXPORT_TIMEOUT,
                     )
-                    if resp.status not in (200, 201, 204):
-                        err = await resp.text()
-                        log.error("Supabase RPC failed %s: %s", resp.status, err)
+                    if status not in (200, 201, 204):
+                        log.error("Supabase RPC failed %s: %s", status, err)
                     else:
                         log.info("✅ Successfully exported Piscinik transcript to Supabase")
                         print(f"📊 Session exported: {len(self._messages)} messages, {duration}s duration")
@@ -236,3 +458,10 @@ class TranscriptCollector:
                     log.exception("Error calling Supabase RPC")
             else:
                 log.warning("No TRANSCRIPTION_WEBHOOK_URL set; skipping Supabase export")
+        finally:
+            await self._close_http()
+
+    async def _close_http(self):
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None